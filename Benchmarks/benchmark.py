@@ -0,0 +1,358 @@
+import os, sys, gc, time, json, argparse, platform, threading, resource, itertools
+import numpy as np
+import pandas as pd
+import torch
+from transformers import (
+    AutoTokenizer,
+    AutoModelForSequenceClassification,
+    AutoModelForSeq2SeqLM,
+    DistilBertConfig,
+    DistilBertForSequenceClassification,
+    BartConfig,
+    BartForConditionalGeneration,
+    PreTrainedTokenizerFast,
+)
+
+# === CONFIG ===
+# Paths are relative to the repo root, like the training scripts
+CLASSIFY_DATA = "ClassificationAI/classifyData.csv"
+PARADETOX_DATA = "DetoxifierAI/paradetox.tsv"
+CLASSIFIER_PATH = os.environ.get("CLASSIFIER_PATH", "ClassificationModel/final_model")
+DETOX_PATH = os.environ.get("DETOX_PATH", "DetoxifierAI/seq2seq-detox-finetuned")
+RESULTS_DIR = "Benchmarks/results"
+SERVER_DIR = "DetoxifierAI/reinforcementTraining"   # scheduler.py lives next to app.py
+
+CLASSIFIER_MAX_LENGTH = 256    # same as train.py DEFAULT_MAX_LENGTH
+DETOX_MAX_LENGTH = 128         # same as init_train.py MAX_LENGTH
+
+# character-length buckets used to sample inputs ("mixed" = natural distribution)
+LENGTH_BUCKETS = {
+    "short": (0, 48),
+    "medium": (49, 96),
+    "long": (97, 10**9),
+    "mixed": (0, 10**9),
+}
+
+DEFAULT_BATCH_SIZES = "1,8,32"
+DEFAULT_LENGTHS = "short,mixed,long"
+DEFAULT_THREADS = "1,%d" % (os.cpu_count() or 1)
+DEFAULT_NUM_OPTIONS = "1,3"
+DEFAULT_MAX_NEW_TOKENS = "auto,100"   # "auto" = app.py rule min(int(len * 1.2), 100)
+DEFAULT_ITERS = 10
+DEFAULT_WARMUP = 2
+DEFAULT_TOLERANCE = 0.10
+
+
+# === MEMORY SAMPLER ===
+def current_rss_bytes():
+    """Resident set size of this process, read from /proc when available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KB on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+class PeakRSS:
+    """Samples RSS on a background thread and keeps the peak seen inside the block.
+
+    The process keeps earlier workloads' allocations, so growth (peak minus the RSS on
+    entry) is the per-config number; peak is the absolute process peak.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    @property
+    def growth(self):
+        return max(0, self.peak - self.baseline)
+
+    def __enter__(self):
+        gc.collect()
+        self.baseline = self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+# === INPUT SAMPLING ===
+def load_texts():
+    classify_texts = pd.read_csv(CLASSIFY_DATA).dropna(subset=["text"])["text"].astype(str).tolist()
+    detox_texts = pd.read_csv(PARADETOX_DATA, sep="\t", dtype=str).fillna("")["toxic"].str.strip()
+    detox_texts = [t for t in detox_texts.tolist() if t]
+    return classify_texts, detox_texts
+
+
+def sample_texts(texts, bucket, n, rng):
+    lo, hi = LENGTH_BUCKETS[bucket]
+    pool = [t for t in texts if lo <= len(t) <= hi] or texts
+    idx = rng.choice(len(pool), size=n, replace=len(pool) < n)
+    return [pool[i] for i in idx]
+
+
+# === MODELS ===
+def build_tiny_tokenizer(texts):
+    """Word-level tokenizer trained on the benchmark corpus, so --tiny needs no downloads."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers, processors
+    specials = ["<pad>", "<unk>", "<s>", "</s>", "<mask>"]
+    tok = Tokenizer(models.WordLevel(unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok.train_from_iterator(texts, trainers.WordLevelTrainer(vocab_size=8000, special_tokens=specials))
+    tok.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>", special_tokens=[("<s>", 2), ("</s>", 3)]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tok, pad_token="<pad>", unk_token="<unk>", bos_token="<s>",
+        eos_token="</s>", cls_token="<s>", sep_token="</s>", mask_token="<mask>",
+    )
+
+
+def load_classifier(tiny, tiny_tokenizer):
+    if not tiny:
+        tokenizer = AutoTokenizer.from_pretrained(CLASSIFIER_PATH)
+        model = AutoModelForSequenceClassification.from_pretrained(CLASSIFIER_PATH)
+        return model.eval(), tokenizer
+    # same architecture as distilbert-base-uncased, scaled down and randomly initialized
+    config = DistilBertConfig(
+        vocab_size=tiny_tokenizer.vocab_size, dim=128, n_layers=2, n_heads=2,
+        hidden_dim=256, max_position_embeddings=512, num_labels=2,
+        pad_token_id=tiny_tokenizer.pad_token_id,
+    )
+    return DistilBertForSequenceClassification(config).eval(), tiny_tokenizer
+
+
+def load_detoxifier(tiny, tiny_tokenizer):
+    if not tiny:
+        tokenizer = AutoTokenizer.from_pretrained(DETOX_PATH)
+        model = AutoModelForSeq2SeqLM.from_pretrained(DETOX_PATH)
+        return model.eval(), tokenizer
+    # same architecture as facebook/bart-base, scaled down and randomly initialized
+    config = BartConfig(
+        vocab_size=tiny_tokenizer.vocab_size, d_model=128, encoder_layers=2, decoder_layers=2,
+        encoder_attention_heads=2, decoder_attention_heads=2, encoder_ffn_dim=256,
+        decoder_ffn_dim=256, max_position_embeddings=512,
+        pad_token_id=tiny_tokenizer.pad_token_id, bos_token_id=tiny_tokenizer.bos_token_id,
+        eos_token_id=tiny_tokenizer.eos_token_id, decoder_start_token_id=tiny_tokenizer.eos_token_id,
+        forced_eos_token_id=tiny_tokenizer.eos_token_id,
+    )
+    return BartForConditionalGeneration(config).eval(), tiny_tokenizer
+
+
+# === WORKLOADS ===
+def run_classifier_batch(model, tokenizer, texts, **_):
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=CLASSIFIER_MAX_LENGTH)
+    with torch.no_grad():
+        model(**inputs)
+    return 0
+
+
+def resolve_max_new_tokens(setting, texts):
+    if setting == "auto":
+        return max(min(int(len(t) * 1.2), 100) for t in texts)
+    return int(setting)
+
+
+def run_detox_batch(model, tokenizer, texts, num_options=1, max_new_tokens="auto"):
+    prompts = [f"detoxify: {t}" for t in texts]
+    inputs = tokenizer(prompts, return_tensors="pt", truncation=True, padding=True, max_length=DETOX_MAX_LENGTH)
+    with torch.no_grad():
+        output = model.generate(
+            **inputs,
+            max_new_tokens=resolve_max_new_tokens(max_new_tokens, texts),
+            temperature=0.9,
+            top_p=0.95,
+            do_sample=True,
+            num_return_sequences=num_options,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    # count generated (non-pad) tokens so tokens/sec is comparable across settings;
+    # the first position of each sequence is the decoder start token, not a generated one
+    return int((output[:, 1:] != tokenizer.pad_token_id).sum().item())
+
+
+def run_detox_scheduled(model, tokenizer, texts, num_options=1, max_new_tokens="auto", scheduler=None):
+    """Same workload as run_detox_batch, but each text is its own request to the continuous-batching scheduler."""
+    prompts = [f"detoxify: {t}" for t in texts]
+    inputs = tokenizer(prompts, return_tensors="pt", truncation=True, padding=True, max_length=DETOX_MAX_LENGTH)
+    with torch.no_grad():
+        hidden = model.get_encoder()(**inputs).last_hidden_state
+    futures = [
+        scheduler.submit(hidden[i], inputs["attention_mask"][i], resolve_max_new_tokens(max_new_tokens, [t]),
+                         num_sequences=num_options)
+        for i, t in enumerate(texts)
+    ]
+    return sum(len(seq) for f in futures for seq in f.result())
+
+
+def measure(fn, batches, warmup, **kwargs):
+    for texts in batches[:warmup]:
+        fn(texts=texts, **kwargs)
+    latencies, tokens = [], 0
+    with PeakRSS() as mem:
+        start = time.perf_counter()
+        for texts in batches[warmup:]:
+            t0 = time.perf_counter()
+            tokens += fn(texts=texts, **kwargs)
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start
+    items = sum(len(b) for b in batches[warmup:])
+    lat_ms = np.array(latencies) * 1000.0
+    return {
+        "items": items,
+        "throughput_items_per_s": items / wall if wall > 0 else float("nan"),
+        "generated_tokens_per_s": tokens / wall if wall > 0 and tokens else 0.0,
+        "latency_ms_p50": float(np.percentile(lat_ms, 50)),
+        "latency_ms_p95": float(np.percentile(lat_ms, 95)),
+        "latency_ms_p99": float(np.percentile(lat_ms, 99)),
+        "latency_ms_mean": float(lat_ms.mean()),
+        "peak_rss_mb": mem.peak / (1024 * 1024),
+        "rss_growth_mb": mem.growth / (1024 * 1024),
+    }
+
+
+def config_key(model_name, cfg):
+    return model_name + "|" + "|".join(f"{k}={cfg[k]}" for k in sorted(cfg))
+
+
+def run_suite(args):
+    rng = np.random.default_rng(args.seed)
+    torch.manual_seed(args.seed)
+    classify_texts, detox_texts = load_texts()
+    tiny = args.tiny
+    if not tiny and not (os.path.isdir(CLASSIFIER_PATH) and os.path.isdir(DETOX_PATH)):
+        print(f"Checkpoints not found ({CLASSIFIER_PATH}, {DETOX_PATH}); falling back to --tiny models.")
+        tiny = True
+    tiny_tokenizer = build_tiny_tokenizer(classify_texts + detox_texts) if tiny else None
+
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",")]
+    lengths = args.lengths.split(",")
+    threads = [int(x) for x in args.threads.split(",")]
+    num_options = [int(x) for x in args.num_options.split(",")]
+    max_new_tokens = args.max_new_tokens.split(",")
+
+    workloads = []
+    if "classifier" in args.models:
+        model, tokenizer = load_classifier(tiny, tiny_tokenizer)
+        for bs, ln, th in itertools.product(batch_sizes, lengths, threads):
+            workloads.append(("classifier", model, tokenizer, run_classifier_batch, classify_texts,
+                              {"batch_size": bs, "length": ln, "threads": th}, {}))
+    if "detoxifier" in args.models:
+        model, tokenizer = load_detoxifier(tiny, tiny_tokenizer)
+        for bs, ln, th, no, mnt in itertools.product(batch_sizes, lengths, threads, num_options, max_new_tokens):
+            workloads.append(("detoxifier", model, tokenizer, run_detox_batch, detox_texts,
+                              {"batch_size": bs, "length": ln, "threads": th, "num_options": no, "max_new_tokens": mnt},
+                              {"num_options": no, "max_new_tokens": mnt}))
+    if "scheduler" in args.models:
+        sys.path.insert(0, SERVER_DIR)
+        from scheduler import GenerationScheduler
+        model, tokenizer = load_detoxifier(tiny, tiny_tokenizer)
+        scheduler = GenerationScheduler(model, max_sequences=args.max_sequences).start()
+        for bs, ln, th, no, mnt in itertools.product(batch_sizes, lengths, threads, num_options, max_new_tokens):
+            workloads.append(("scheduler", model, tokenizer, run_detox_scheduled, detox_texts,
+                              {"batch_size": bs, "length": ln, "threads": th, "num_options": no, "max_new_tokens": mnt},
+                              {"num_options": no, "max_new_tokens": mnt, "scheduler": scheduler}))
+
+    results = []
+    for name, model, tokenizer, fn, texts, cfg, extra in workloads:
+        torch.set_num_threads(cfg["threads"])
+        batches = [sample_texts(texts, cfg["length"], cfg["batch_size"], rng)
+                   for _ in range(args.warmup + args.iters)]
+        stats = measure(fn, batches, args.warmup, model=model, tokenizer=tokenizer, **extra)
+        entry = {"model": name, "key": config_key(name, cfg), "config": cfg, **stats}
+        results.append(entry)
+        print(f"{entry['key']}: {stats['throughput_items_per_s']:.2f} items/s, "
+              f"p50={stats['latency_ms_p50']:.1f}ms p95={stats['latency_ms_p95']:.1f}ms "
+              f"p99={stats['latency_ms_p99']:.1f}ms rss=+{stats['rss_growth_mb']:.0f}MB")
+
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "tiny": tiny,
+            "classifier_path": None if tiny else CLASSIFIER_PATH,
+            "detox_path": None if tiny else DETOX_PATH,
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "iters": args.iters,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+# === REGRESSION COMPARISON ===
+def compare(current, baseline, tolerance):
+    """Return a list of regressions: throughput drops or p95 latency rises beyond tolerance."""
+    if current["meta"].get("tiny") != baseline["meta"].get("tiny"):
+        print("Warning: comparing tiny and checkpoint runs; numbers are not comparable.")
+    base_by_key = {r["key"]: r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        b = base_by_key.get(r["key"])
+        if b is None:
+            continue
+        tput = r["throughput_items_per_s"] / b["throughput_items_per_s"] - 1.0
+        p95 = r["latency_ms_p95"] / b["latency_ms_p95"] - 1.0
+        # baselines written before rss_growth_mb existed only have the process peak
+        rss_key = "rss_growth_mb" if "rss_growth_mb" in b else "peak_rss_mb"
+        rss = r[rss_key] - b[rss_key]
+        print(f"{r['key']}: throughput {tput:+.1%}, p95 {p95:+.1%}, rss {rss:+.0f}MB")
+        if tput < -tolerance or p95 > tolerance:
+            regressions.append({"key": r["key"], "throughput_change": tput, "p95_change": p95, "rss_change_mb": rss})
+    return regressions
+
+
+# === MAIN ===
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Offline inference benchmark for the classifier and detoxifier.")
+    p.add_argument("--models", default="classifier,detoxifier", help="any of classifier,detoxifier,scheduler")
+    p.add_argument("--tiny", action="store_true", help="use tiny randomly initialized models (no downloads)")
+    p.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES)
+    p.add_argument("--lengths", default=DEFAULT_LENGTHS, help=",".join(LENGTH_BUCKETS))
+    p.add_argument("--threads", default=DEFAULT_THREADS)
+    p.add_argument("--num-options", default=DEFAULT_NUM_OPTIONS)
+    p.add_argument("--max-new-tokens", default=DEFAULT_MAX_NEW_TOKENS)
+    p.add_argument("--max-sequences", type=int, default=16, help="scheduler decode slots")
+    p.add_argument("--iters", type=int, default=DEFAULT_ITERS)
+    p.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    p.add_argument("--compare", default=None, help="baseline JSON to check for regressions")
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_suite(args)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for r in regressions:
+                print(f"  {r['key']}: throughput {r['throughput_change']:+.1%}, p95 {r['p95_change']:+.1%}")
+            sys.exit(1)
+        print("No regressions.")
@@ -8,9 +8,16 @@ const CONFIG = {
   MAX_RETRIES: 4,
   LOG_CAP: 500,
   DETOX_CONCURRENCY: 4,
-  CACHE_WRITE_INTERVAL_MS: 5000
+  CACHE_WRITE_INTERVAL_MS: 5000,
+  BATCH_API: true,
+  BATCH_MAX_ITEMS: 64
 };
 
+// Batch API state: when the backend has no batch routes, use per-text requests for a while.
+// Batch POSTs are not retried; network errors and 429s only fall back for the current scan.
+const BATCH_API_RETRY_MS = 1000 * 60 * 10;
+let batchApiRetryAt = 0;
+
 // In-memory caches to reduce duplicate API calls for identical texts
 const classificationCache = new Map(); // key -> { ts, result }
 const detoxCache = new Map(); // key -> { ts, output }
@@ -155,7 +162,9 @@ async function fetchWithRetry(url, options, maxAttempts = CONFIG.MAX_RETRIES) {
           await wait(delay + Math.floor(Math.random() * 100));
           continue;
         }
-        return { success: false, error: String(lastError), attempts: attempt };
+        // keep the status and any JSON error body so callers can tell a missing route apart
+        const body = await res.json().catch(() => null);
+        return { success: false, error: String(lastError), attempts: attempt, status: res.status, json: body };
       }
       const json = await res.json();
       return { success: true, json, attempts: attempt };
@@ -172,6 +181,36 @@ async function fetchWithRetry(url, options, maxAttempts = CONFIG.MAX_RETRIES) {
   return { success: false, error: String(lastError), attempts: maxAttempts };
 }
 
+// Normalize a /classify response (single or one batch item) into the extension's result shape
+function toClassificationResult(data, attempts, text) {
+  const conf = data?.confidence || {};
+  // Support both old format (LABEL_0/LABEL_1) and new format (non-toxic/toxic)
+  const label0Confidence = conf.LABEL_0 ?? conf['non-toxic'] ?? 0;
+  let toxicConfidence = conf.LABEL_1 ?? conf.toxic ?? 0;
+  const classification = data.classification;
+
+  // Convert to percentage for consistent comparison
+  const toxicPercentage = toxicConfidence * 100;
+
+  // Normalize classification to "toxic" or "non-toxic"
+  const isToxic =
+    (classification === "toxic" || classification === "LABEL_1") &&
+    toxicPercentage >= CONFIG.TOXIC_CONFIDENCE_THRESHOLD;
+
+  // Debug logging
+  console.log(`[classify] text="${String(text).slice(0, 50)}..." classification=${classification} toxic=${toxicPercentage.toFixed(2)}% threshold=${CONFIG.TOXIC_CONFIDENCE_THRESHOLD}% isToxic=${isToxic}`);
+
+  const result = {
+    success: true,
+    classification: data.classification,
+    isToxic,
+    confidence: { label0: label0Confidence, label1: toxicConfidence },
+    toxicPercentage,
+    attempts
+  };
+  return result;
+}
+
 async function classifyText(text) {
   try {
     const key = String(text).slice(0, 5000);
@@ -192,32 +231,7 @@ async function classifyText(text) {
       return { success: false, error: res.error, attempts: res.attempts };
     }
 
-    const data = res.json;
-    const conf = data?.confidence || {};
-    // Support both old format (LABEL_0/LABEL_1) and new format (non-toxic/toxic)
-    const label0Confidence = conf.LABEL_0 ?? conf['non-toxic'] ?? 0;
-    let toxicConfidence = conf.LABEL_1 ?? conf.toxic ?? 0;
-    const classification = data.classification;
-
-    // Convert to percentage for consistent comparison
-    const toxicPercentage = toxicConfidence * 100;
-
-    // Normalize classification to "toxic" or "non-toxic"
-    const isToxic =
-      (classification === "toxic" || classification === "LABEL_1") &&
-      toxicPercentage >= CONFIG.TOXIC_CONFIDENCE_THRESHOLD;
-
-    // Debug logging
-    console.log(`[classify] text="${String(text).slice(0, 50)}..." classification=${classification} toxic=${toxicPercentage.toFixed(2)}% threshold=${CONFIG.TOXIC_CONFIDENCE_THRESHOLD}% isToxic=${isToxic}`);
-
-    const result = {
-      success: true,
-      classification: data.classification,
-      isToxic,
-      confidence: { label0: label0Confidence, label1: toxicConfidence },
-      toxicPercentage,
-      attempts: res.attempts
-    };
+    const result = toClassificationResult(res.json, res.attempts, text);
 
     try {
       classificationCache.set(key, { ts: Date.now(), result });
@@ -263,9 +277,18 @@ async function detoxifyTextSingle(text) {
     return { output: text, attempts: r.attempts, error: r.error };
   }
 
+  const output = extractDetoxOutput(r.json || {}, text);
+
+  try { detoxCache.set(key, { ts: Date.now(), output });
+    markCacheDirty('detox');
+  } catch (e) {}
+  return { output, attempts: r.attempts, error: null };
+}
+
+// Pull the detoxified text out of a /detoxify response (single or one batch item)
+function extractDetoxOutput(json, text) {
   // Support both old format and new format
   let output = text;
-  const json = r.json || {};
   if (Array.isArray(json.detoxified) && json.detoxified.length > 0) {
     output = json.detoxified[0];
   } else if (json.detoxified) {
@@ -276,13 +299,152 @@ async function detoxifyTextSingle(text) {
     output = json.output[0];
   }
 
-  try { detoxCache.set(key, { ts: Date.now(), output });
-    markCacheDirty('detox');
-  } catch (e) {}
-  return { output, attempts: r.attempts, error: null };
+  return output;
+}
+
+// A backend without batch routes answers 404/405, or 400 / 5xx / 200 without a results list
+// (an old /detoxify fails on data["text"] when given {items: [...]})
+function batchRoutesMissing(res) {
+  if (res.status === 404 || res.status === 405) return true;
+  if (res.status === 400 || res.status >= 500 || res.success) return !Array.isArray(res.json?.results);
+  return false;
+}
+
+// POST texts as {items: [{id, text}]} in chunks; returns one {ok, ..., attempts} per text,
+// or null if a request as a whole failed (e.g. the backend has no batch routes)
+async function postBatch(path, texts, extra = {}) {
+  const out = [];
+  const max = CONFIG.BATCH_MAX_ITEMS || 64;
+  for (let start = 0; start < texts.length; start += max) {
+    const chunk = texts.slice(start, start + max);
+    // single attempt: on failure the per-text path retries each text anyway
+    const res = await fetchWithRetry(`${CONFIG.API_BASE}${path}`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(Object.assign({ items: chunk.map((text, i) => ({ id: start + i, text })) }, extra))
+    }, 1);
+    if (!res.success || !Array.isArray(res.json?.results)) {
+      if (batchRoutesMissing(res)) batchApiRetryAt = Date.now() + BATCH_API_RETRY_MS;
+      return null;
+    }
+    const byId = new Map(res.json.results.map((item) => [item.id, item]));
+    chunk.forEach((text, i) => {
+      const item = byId.get(start + i) || { ok: false, error: "Missing result" };
+      out.push(Object.assign({ attempts: res.attempts }, item));
+    });
+  }
+  return out;
+}
+
+// One /classify and one /detoxify request for all uncached texts of a page scan.
+// Items that fail individually go through the per-text path; returns null if the
+// batch routes are unavailable.
+async function detoxifyTextBatchApi(texts) {
+  const capped = texts.map((t) => (typeof t === "string" && t.length > 5000 ? t.slice(0, 5000) : t));
+  const results = new Array(capped.length);
+  const now = Date.now();
+
+  const pending = [];
+  capped.forEach((t, i) => {
+    const cached = detoxCache.get(String(t).slice(0, 5000));
+    if (cached && now - cached.ts < CACHE_TTL_MS) {
+      results[i] = { output: cached.output, attempts: 0, error: null, cached: true };
+    } else {
+      pending.push(i);
+    }
+  });
+  if (pending.length === 0) return results;
+
+  const unique = [...new Set(pending.map((i) => String(capped[i])))];
+  const classifications = new Map();
+  const toClassify = [];
+  unique.forEach((t) => {
+    const cached = classificationCache.get(t);
+    if (cached && now - cached.ts < CACHE_TTL_MS) {
+      classifications.set(t, Object.assign({}, cached.result, { cached: true }));
+    } else {
+      toClassify.push(t);
+    }
+  });
+
+  if (toClassify.length > 0) {
+    const batch = await postBatch("/classify", toClassify);
+    if (!batch) return null;
+    batch.forEach((item, j) => {
+      const t = toClassify[j];
+      if (!item.ok) {
+        classifications.set(t, { success: false, error: item.error, attempts: item.attempts });
+        return;
+      }
+      const result = toClassificationResult(item, item.attempts, t);
+      classifications.set(t, result);
+      try {
+        classificationCache.set(t, { ts: Date.now(), result });
+        markCacheDirty('classification');
+      } catch (e) {}
+    });
+  }
+
+  const toxic = unique.filter((t) => {
+    const c = classifications.get(t);
+    return c && c.success && c.isToxic;
+  });
+  const outputs = new Map();
+  if (toxic.length > 0) {
+    const batch = await postBatch("/detoxify", toxic);
+    if (!batch) return null;
+    batch.forEach((item, j) => {
+      if (!item.ok) return;
+      const t = toxic[j];
+      const output = extractDetoxOutput(item, t);
+      outputs.set(t, { output, attempts: item.attempts, error: null });
+      try {
+        detoxCache.set(t, { ts: Date.now(), output });
+        markCacheDirty('detox');
+      } catch (e) {}
+    });
+  }
+
+  const retry = [];
+  pending.forEach((i) => {
+    const t = String(capped[i]);
+    const c = classifications.get(t);
+    if (!c || !c.success) {
+      retry.push(i);
+    } else if (!c.isToxic) {
+      // cache that detox is not needed
+      try {
+        detoxCache.set(t, { ts: Date.now(), output: capped[i] });
+        markCacheDirty('detox');
+      } catch (e) {}
+      results[i] = { output: capped[i], attempts: c.attempts, error: null };
+    } else if (outputs.has(t)) {
+      results[i] = outputs.get(t);
+    } else {
+      retry.push(i);
+    }
+  });
+
+  if (retry.length > 0) {
+    const retried = await detoxifyTextConcurrent(retry.map((i) => capped[i]));
+    retry.forEach((i, j) => { results[i] = retried[j]; });
+  }
+  return results;
 }
 
 async function detoxifyTextBatch(texts) {
+  if (CONFIG.BATCH_API && Date.now() >= batchApiRetryAt) {
+    try {
+      const results = await detoxifyTextBatchApi(texts);
+      if (results) return results;
+    } catch (e) {
+      console.warn("Batch API failed, falling back to per-text requests", e);
+    }
+  }
+  return detoxifyTextConcurrent(texts);
+}
+
+async function detoxifyTextConcurrent(texts) {
   // Run detox operations with limited concurrency to speed up throughput
   const tasks = texts.map((t) => {
     return async () => {
@@ -0,0 +1,216 @@
+import os, csv, json, time, argparse
+from collections import deque
+import multiprocessing as mp
+import pandas as pd
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+# === CONFIG ===
+MODEL_DIR = "./ClassificationModel/final_model"   # written by train.py save_model
+DEFAULT_CHUNK_SIZE = 2000     # rows handed to a worker at a time
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_LENGTH = 256      # same as train.py
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+# === WORKER ===
+# Each worker process loads the checkpoint once and scores whole chunks.
+_worker = {}
+
+def init_worker(model_dir, threads, max_length, batch_size):
+    torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    label_map_path = os.path.join(model_dir, "label_map.json")
+    if os.path.exists(label_map_path):
+        with open(label_map_path) as f:
+            label_map = {int(k): v for k, v in json.load(f).items()}
+    else:
+        label_map = {int(k): v for k, v in model.config.id2label.items()}
+    _worker.update(tokenizer=tokenizer, model=model, label_map=label_map,
+                   max_length=max_length, batch_size=batch_size)
+
+
+def score_chunk(texts):
+    """Return (pred_label, probabilities) per text, batching in length-sorted order to minimise padding."""
+    tokenizer, model = _worker["tokenizer"], _worker["model"]
+    label_map, batch_size = _worker["label_map"], _worker["batch_size"]
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    results = [None] * len(texts)
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            inputs = tokenizer([texts[i] for i in idx], return_tensors="pt", truncation=True,
+                               padding=True, max_length=_worker["max_length"])
+            probs = torch.softmax(model(**inputs).logits, dim=-1).tolist()
+            for i, p in zip(idx, probs):
+                pred = max(range(len(p)), key=p.__getitem__)
+                results[i] = (label_map.get(pred, str(pred)), p)
+    return results
+
+
+# === INPUT ===
+def read_chunks(path, text_column, chunk_size, skip_rows):
+    """Yield lists of row dicts from CSV or JSONL without loading the whole file."""
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        chunk, seen = [], 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                seen += 1
+                if seen <= skip_rows:
+                    continue
+                chunk.append(json.loads(line))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    seen = 0
+    for df in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        first = seen
+        seen += len(df)
+        if seen <= skip_rows:
+            continue
+        df = df.iloc[max(0, skip_rows - first):]
+        if text_column not in df.columns:
+            raise ValueError(f"Column '{text_column}' not found in {path}; columns are {list(df.columns)}")
+        yield df.to_dict("records")
+
+
+# === PROGRESS ===
+def load_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path) as f:
+        return json.load(f)
+
+
+def save_progress(progress_path, state):
+    tmp = progress_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, progress_path)
+
+
+# === MAIN LOOP ===
+def bulk_score(input_path, output_path, model_dir=MODEL_DIR, text_column="text", label_column="label",
+               id_column=None, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+               batch_size=DEFAULT_BATCH_SIZE, max_length=DEFAULT_MAX_LENGTH, resume=True):
+    progress_path = output_path + ".progress.json"
+    progress = load_progress(progress_path) if resume else None
+    if progress and progress.get("input") != os.path.abspath(input_path):
+        raise ValueError(f"{progress_path} belongs to {progress.get('input')}; remove it or pass --no-resume")
+    rows_done = progress["rows_done"] if progress else 0
+    agree = progress.get("agree", 0) if progress else 0
+    labelled = progress.get("labelled", 0) if progress else 0
+
+    # Drop any rows written after the last recorded checkpoint
+    if progress and os.path.exists(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(progress["output_bytes"])
+        print(f"Resuming {input_path} at row {rows_done}")
+    elif os.path.exists(output_path):
+        os.remove(output_path)
+
+    with open(os.path.join(model_dir, "label_map.json")) as f:
+        label_names = [v for _, v in sorted((int(k), v) for k, v in json.load(f).items())]
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    ctx = mp.get_context("spawn")
+    pool = ctx.Pool(workers, initializer=init_worker, initargs=(model_dir, threads, max_length, batch_size))
+
+    start = time.time()
+    write_header = rows_done == 0
+    with open(output_path, "a", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        if write_header:
+            header = ["row"] + ([id_column] if id_column else []) + ["pred_label"]
+            header += [f"prob_{name}" for name in label_names] + ["label", "agrees"]
+            writer.writerow(header)
+
+        # Keep at most 2 chunks per worker in flight so memory stays flat regardless of input size
+        pending = deque()
+        chunks = read_chunks(input_path, text_column, chunk_size, rows_done)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < workers * 2:
+                rows = next(chunks, None)
+                if rows is None:
+                    exhausted = True
+                    break
+                texts = [str(r.get(text_column, "") or "") for r in rows]
+                pending.append((rows, pool.apply_async(score_chunk, (texts,))))
+            if not pending:
+                break
+
+            rows, result = pending.popleft()
+            for row, (pred, probs) in zip(rows, result.get()):
+                label = row.get(label_column, "")
+                label = "" if label is None else str(label).strip()
+                if label:
+                    # classifyData.csv stores labels as floats (0.0/1.0)
+                    try:
+                        label = str(int(float(label)))
+                    except ValueError:
+                        pass
+                    labelled += 1
+                    agree += int(label == pred)
+                out_row = [rows_done] + ([row.get(id_column, "")] if id_column else []) + [pred]
+                out_row += [f"{p:.6f}" for p in probs] + [label, "" if not label else int(label == pred)]
+                writer.writerow(out_row)
+                rows_done += 1
+            out.flush()
+            os.fsync(out.fileno())
+            save_progress(progress_path, {
+                "input": os.path.abspath(input_path), "rows_done": rows_done,
+                "output_bytes": out.tell(), "labelled": labelled, "agree": agree,
+            })
+            elapsed = time.time() - start
+            print(f"Scored {rows_done} rows ({elapsed:.0f}s)")
+
+    pool.close()
+    pool.join()
+    if labelled:
+        print(f"Label agreement: {agree}/{labelled} = {agree / labelled:.4f}")
+    print(f"Scores written to {output_path}")
+    return rows_done
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Stream a CSV/JSONL file through the classifier and write scores.")
+    p.add_argument("input", help="CSV or JSONL file with a text column")
+    p.add_argument("output", help="CSV file to write scores to")
+    p.add_argument("--model-dir", default=MODEL_DIR)
+    p.add_argument("--text-column", default="text")
+    p.add_argument("--label-column", default="label", help="optional; rows with a label are checked against the prediction")
+    p.add_argument("--id-column", default=None)
+    p.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    p.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p.add_argument("--max-length", type=int, default=DEFAULT_MAX_LENGTH)
+    p.add_argument("--no-resume", action="store_true", help="ignore any saved progress and start over")
+    return p.parse_args(argv)
+
+
+# === MAIN ===
+if __name__ == "__main__":
+    args = parse_args()
+    bulk_score(
+        input_path=args.input,
+        output_path=args.output,
+        model_dir=args.model_dir,
+        text_column=args.text_column,
+        label_column=args.label_column,
+        id_column=args.id_column,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        max_length=args.max_length,
+        resume=not args.no_resume,
+    )
@@ -1,9 +1,9 @@
-import os, math, time, csv, json
+import os, re, sys, math, time, csv, json, random, hashlib, threading
 import numpy as np
 import pandas as pd
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import accuracy_score, classification_report
@@ -19,6 +19,23 @@ DEFAULT_BATCH_SIZE = 32        # smaller batch size
 DEFAULT_LR = 5e-5              # Hugging Face default
 DEFAULT_MAX_LENGTH = 256
 DEFAULT_DROPOUT = 0.5
+DEFAULT_SEED = 42
+
+CHECKPOINT_EVERY = 200         # steps between resumable checkpoints
+KEEP_CHECKPOINTS = 3           # older checkpoints are deleted
+
+# Memory-bounded mode: batches are split into micro-batches with gradient accumulation,
+# so the effective batch size (and its hyperparameter meaning) is unchanged.
+MICRO_BATCH_SIZE = None        # None = whole batch at once, or derived from MAX_RSS_MB
+MAX_RSS_MB = None              # target peak resident memory; picks MICRO_BATCH_SIZE automatically
+GRADIENT_CHECKPOINTING = False # recompute activations in backward instead of storing them
+BF16 = False                   # bfloat16 autocast for forward passes
+
+# Data preparation before train_test_split
+DEDUPLICATE = True             # keep one row per normalized text
+COLLECT_EXAMPLE_STATS = False  # write per-example loss/forgetting stats for coreset selection
+CORESET_STATS = None           # example_stats.csv from an earlier (short) run
+CORESET_KEEP = 1.0             # fraction of the training split kept when CORESET_STATS is set
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print("Using device:", DEVICE)
@@ -30,21 +47,204 @@ os.makedirs(RUNS_DIR, exist_ok=True)
 
 # === DATASET CLASS ===
 class TextDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_length=256):
+    def __init__(self, texts, labels, tokenizer, max_length=256, return_index=False):
         self.encodings = tokenizer(
             texts, truncation=True, padding="max_length", max_length=max_length
         )
         self.labels = labels
         self.keys = list(self.encodings.keys())
+        self.return_index = return_index
 
     def __getitem__(self, idx):
         item = {key: torch.tensor(self.encodings[key][idx]) for key in self.keys}
         item["labels"] = torch.tensor(self.labels[idx], dtype=torch.long)
+        if self.return_index:
+            item["index"] = torch.tensor(idx, dtype=torch.long)
         return item
 
     def __len__(self):
         return len(self.labels)
 
+# === DATA PREPARATION ===
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def text_key(text):
+    return hashlib.md5(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def deduplicate(df):
+    """Keep one row per normalized text, labelled with the group's majority label.
+
+    Runs before train_test_split, so copies of a text can never end up on both sides.
+    """
+    df = df.assign(key=df["text"].map(text_key))
+    majority = df.groupby("key")["label"].agg(lambda s: s.value_counts().idxmax())
+    deduped = df.drop_duplicates("key").copy()
+    deduped["label"] = deduped["key"].map(majority)
+    return deduped.drop(columns="key").reset_index(drop=True)
+
+
+class ExampleStats:
+    """Per-example training dynamics: mean loss and forgetting events (correct -> incorrect)."""
+    def __init__(self, texts):
+        n = len(texts)
+        self.keys = [text_key(t) for t in texts]
+        self.loss_sum = np.zeros(n)
+        self.seen = np.zeros(n, dtype=int)
+        self.forgetting = np.zeros(n, dtype=int)
+        self.correct = np.zeros(n, dtype=bool)
+        self.ever_correct = np.zeros(n, dtype=bool)
+
+    def update(self, indices, losses, correct):
+        for i, loss, ok in zip(indices, losses, correct):
+            self.loss_sum[i] += loss
+            self.seen[i] += 1
+            if self.correct[i] and not ok:
+                self.forgetting[i] += 1
+            self.correct[i] = ok
+            self.ever_correct[i] |= ok
+
+    def state_dict(self):
+        return {"keys": list(self.keys), "loss_sum": self.loss_sum.copy(), "seen": self.seen.copy(),
+                "forgetting": self.forgetting.copy(), "correct": self.correct.copy(),
+                "ever_correct": self.ever_correct.copy()}
+
+    def load_state_dict(self, state):
+        if state["keys"] != self.keys:
+            raise ValueError("Example stats in the checkpoint belong to different training data")
+        for name in ("loss_sum", "seen", "forgetting", "correct", "ever_correct"):
+            setattr(self, name, state[name].copy())
+
+    def save(self, path):
+        pd.DataFrame({
+            "key": self.keys,
+            "seen": self.seen,
+            "mean_loss": self.loss_sum / np.maximum(self.seen, 1),
+            "forgetting_events": self.forgetting,
+            "ever_correct": self.ever_correct,
+        }).to_csv(path, index=False)
+        print(f"Example stats saved to {path}")
+
+
+def select_coreset(texts, labels, stats_path, keep_fraction):
+    """Keep the hardest keep_fraction of each label in the training split.
+
+    Examples never learned rank first, then more forgetting events, then higher mean loss.
+    Examples missing from the stats file (new data) are always kept.
+    """
+    stats = pd.read_csv(stats_path).drop_duplicates("key").set_index("key")
+    keys = [text_key(t) for t in texts]
+    keep = []
+    for label in sorted(set(labels)):
+        members = [i for i, l in enumerate(labels) if l == label]
+        known = [i for i in members if keys[i] in stats.index]
+        keep.extend(i for i in members if keys[i] not in stats.index)
+        s = stats.loc[[keys[i] for i in known]]
+        forgetting = np.where(s["ever_correct"].values, s["forgetting_events"].values, np.inf)
+        order = np.lexsort((-s["mean_loss"].values, -forgetting))
+        n_keep = max(0, int(round(keep_fraction * len(members))) - (len(members) - len(known)))
+        keep.extend(known[j] for j in order[:n_keep])
+    keep.sort()
+    return [texts[i] for i in keep], [labels[i] for i in keep]
+
+# === MEMORY ===
+def current_rss_mb():
+    """Resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class PeakRSS:
+    """Samples RSS on a background thread and keeps the peak seen inside the block."""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def estimate_micro_batch_size(model, dataset, batch_size, max_rss_mb, bf16=False):
+    """Pick the largest micro-batch that should keep peak RSS under max_rss_mb.
+
+    Runs forward/backward at micro-batch sizes 1 and 4, fits peak = fixed + per_sample * m,
+    and adds AdamW's two moment buffers, which the probe does not allocate.
+    """
+    rng_state, was_training = get_rng_state(), model.training
+    model.train()
+    base_mb = current_rss_mb()
+    peaks = {}
+    for m in (1, 4):
+        batch = next(iter(DataLoader(dataset, batch_size=m, generator=torch.Generator())))
+        batch = {k: v.to(DEVICE) for k, v in batch.items()}
+        with PeakRSS(interval=0.002) as mem:
+            with torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16, enabled=bf16):
+                outputs = model(**batch)
+            outputs.loss.backward()
+        model.zero_grad(set_to_none=True)
+        peaks[m] = mem.peak_mb - base_mb
+    set_rng_state(rng_state)
+    model.train(was_training)
+
+    per_sample = max((peaks[4] - peaks[1]) / 3, 1e-3)
+    adam_mb = 2 * sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad) / (1024 * 1024)
+    fixed = max(peaks[1] - per_sample, 0.0) + adam_mb
+    budget = max_rss_mb - base_mb - fixed
+    micro = int(budget // per_sample)
+    if micro < 1:
+        print(f"Warning: MAX_RSS_MB={max_rss_mb} is below the estimated minimum "
+              f"({base_mb + fixed + per_sample:.0f}MB); using micro-batches of 1.")
+    micro = max(1, min(batch_size, micro))
+    print(f"Memory estimate: base={base_mb:.0f}MB fixed={fixed:.0f}MB per_sample={per_sample:.1f}MB "
+          f"-> micro_batch_size={micro}")
+    return micro
+
+# === SHUFFLING ===
+class EpochSampler(Sampler):
+    """Shuffles with a per-epoch seed so a resumed run sees the same batch order.
+
+    set_epoch(epoch, start) skips the first `start` samples of that epoch's order.
+    """
+    def __init__(self, num_samples, seed=DEFAULT_SEED):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.num_samples, generator=g)[self.start:].tolist())
+
+    def __len__(self):
+        return max(0, self.num_samples - self.start)
+
 # === EVALUATION ===
 def evaluate_loader(model, data_loader, device):
     model.eval()
@@ -74,13 +274,122 @@ def save_model(model, tokenizer, label_encoder, output_dir):
         json.dump(label_map, f)
     print(f"Model + tokenizer + label_map saved to {output_dir}")
 
+# === CHECKPOINTING ===
+def _cpu_clone(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_clone(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_clone(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class AsyncCheckpointer:
+    """Writes training snapshots on a background thread and keeps the newest `keep` files."""
+    def __init__(self, checkpoint_dir, keep=KEEP_CHECKPOINTS):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self._thread = None
+        self._error = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def checkpoints(self):
+        names = sorted(n for n in os.listdir(self.checkpoint_dir) if n.startswith("ckpt_step") and n.endswith(".pt"))
+        return [os.path.join(self.checkpoint_dir, n) for n in names]
+
+    def latest(self):
+        ckpts = self.checkpoints()
+        return ckpts[-1] if ckpts else None
+
+    def save(self, step, state):
+        # only one write in flight, so at most one extra copy of the weights is held in memory
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(step, state))
+        self._thread.start()
+
+    def _write(self, step, state):
+        try:
+            path = os.path.join(self.checkpoint_dir, f"ckpt_step{step:08d}.pt")
+            torch.save(state, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            for old in self.checkpoints()[:-self.keep]:
+                os.remove(old)
+        except Exception as e:
+            # raised from wait(), so a failed write stops training instead of going unnoticed
+            self._error = e
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Writing a checkpoint to {self.checkpoint_dir} failed") from error
+
+
+def snapshot_state(model, optimizer, step, epoch, batch_in_epoch, log_file, csvf, example_stats=None,
+                   train_seconds=0.0, peak_rss_mb=0.0):
+    """Copy everything needed to resume onto the CPU; the copy is then safe to write off-thread.
+
+    train_seconds and peak_rss_mb cover the run so far, so a resumed run reports totals.
+    """
+    log_file.flush()
+    csvf.flush()
+    state = {
+        "model": _cpu_clone(model.state_dict()),
+        "optimizer": _cpu_clone(optimizer.state_dict()),
+        "rng": get_rng_state(),
+        "step": step,
+        "epoch": epoch,
+        "batch_in_epoch": batch_in_epoch,
+        # evaluate_loader leaves the model in eval mode until the next epoch starts
+        "training": model.training,
+        "log_bytes": log_file.tell(),
+        "csv_bytes": csvf.tell(),
+        "train_seconds": train_seconds,
+        "peak_rss_mb": peak_rss_mb,
+    }
+    if example_stats is not None:
+        state["example_stats"] = example_stats.state_dict()
+    return state
+
 # === TRAINING ===
-def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_name, data_file, output_dir):
+def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_name, data_file, output_dir,
+              checkpoint_every=CHECKPOINT_EVERY, keep_checkpoints=KEEP_CHECKPOINTS, resume=False, seed=DEFAULT_SEED,
+              micro_batch_size=MICRO_BATCH_SIZE, max_rss_mb=MAX_RSS_MB,
+              gradient_checkpointing=GRADIENT_CHECKPOINTING, bf16=BF16,
+              dedupe=DEDUPLICATE, collect_example_stats=COLLECT_EXAMPLE_STATS,
+              coreset_stats=CORESET_STATS, coreset_keep=CORESET_KEEP):
     tokenizer = AutoTokenizer.from_pretrained(model_name)
 
     # load data
     df = pd.read_csv(data_file).dropna(subset=["text", "label"]).reset_index(drop=True)
     df["label"] = df["label"].astype(int)   # ensure int labels
+    data_report = {"rows_raw": len(df)}
+    if dedupe:
+        df = deduplicate(df)
+        print(f"Deduplicated: {data_report['rows_raw']} -> {len(df)} rows")
+    data_report["rows_after_dedupe"] = len(df)
     le = LabelEncoder()
     df["label"] = le.fit_transform(df["label"])
 
@@ -91,11 +400,21 @@ def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_
         df["text"].tolist(), df["label"].tolist(),
         test_size=0.2, random_state=42, stratify=df["label"].tolist()
     )
+    data_report["train_rows_before_coreset"] = len(train_texts)
+    if coreset_stats and coreset_keep < 1.0:
+        train_texts, train_labels = select_coreset(train_texts, train_labels, coreset_stats, coreset_keep)
+        print(f"Coreset: kept {len(train_texts)}/{data_report['train_rows_before_coreset']} training rows")
+    data_report["train_rows"] = len(train_texts)
+    data_report["val_rows"] = len(val_texts)
+    example_stats = ExampleStats(train_texts) if collect_example_stats else None
 
-    train_dataset = TextDataset(train_texts, train_labels, tokenizer, max_length=max_length)
+    train_dataset = TextDataset(train_texts, train_labels, tokenizer, max_length=max_length,
+                                return_index=example_stats is not None)
     val_dataset = TextDataset(val_texts, val_labels, tokenizer, max_length=max_length)
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size)
+    # Loaders get their own generators so iterating them never draws from the global RNG (used by dropout)
+    train_sampler = EpochSampler(len(train_dataset), seed=seed)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, sampler=train_sampler, generator=torch.Generator())
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, generator=torch.Generator())
 
     # model config
     config = AutoConfig.from_pretrained(model_name, num_labels=len(le.classes_))
@@ -106,36 +425,92 @@ def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_
 
     model = AutoModelForSequenceClassification.from_pretrained(model_name, config=config)
     model.to(DEVICE)
+    if gradient_checkpointing:
+        model.gradient_checkpointing_enable()
+    if micro_batch_size is None and max_rss_mb:
+        micro_batch_size = estimate_micro_batch_size(model, train_dataset, batch_size, max_rss_mb, bf16=bf16)
     optimizer = AdamW(model.parameters(), lr=learning_rate)
     loss_fn = nn.CrossEntropyLoss()
 
     # logging setup
     run_name = f"bs{batch_size}_lr{learning_rate:.0e}_ml{max_length}_do{dropout}"
+    if coreset_stats and coreset_keep < 1.0:
+        run_name += f"_core{coreset_keep:g}"
     run_output = os.path.join(RUNS_DIR, run_name)
     os.makedirs(run_output, exist_ok=True)
     step_log_path = os.path.join(run_output, "step_metrics.txt")
     step_csv_path = os.path.join(run_output, "step_summary.csv")
+    checkpointer = AsyncCheckpointer(os.path.join(run_output, "checkpoints"), keep=keep_checkpoints)
+
+    step, start_epoch, start_batch = 0, 0, 0
+    prior_seconds, prior_peak_mb = 0.0, 0.0   # from the interrupted part of a resumed run
+    resume_path = checkpointer.latest() if resume else None
+    if resume_path:
+        state = torch.load(resume_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        set_rng_state(state["rng"])
+        step, start_epoch, start_batch = state["step"], state["epoch"], state["batch_in_epoch"]
+        prior_seconds, prior_peak_mb = state["train_seconds"], state["peak_rss_mb"]
+        if example_stats is not None:
+            # stats restarted mid-run would rank the coreset on partial loss/forgetting history
+            if "example_stats" not in state:
+                raise ValueError(f"{resume_path} has no example stats; resume without collect_example_stats "
+                                 "or start the run over")
+            example_stats.load_state_dict(state["example_stats"])
+        # drop log lines written after the checkpoint, then keep appending
+        for path, size in [(step_log_path, state["log_bytes"]), (step_csv_path, state["csv_bytes"])]:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+        print(f"Resuming from {resume_path} (step {step}, epoch {start_epoch+1}, batch {start_batch})")
+    else:
+        if resume:
+            print("No checkpoint found, starting from scratch.")
+        torch.manual_seed(seed)
 
-    with open(step_log_path, "w", encoding="utf-8") as log_file, open(step_csv_path, "w", newline='', encoding="utf-8") as csvf:
+    mode = "a" if resume_path else "w"
+    with PeakRSS() as peak_mem, open(step_log_path, mode, encoding="utf-8") as log_file, \
+            open(step_csv_path, mode, newline='', encoding="utf-8") as csvf:
         csv_writer = csv.writer(csvf)
-        csv_writer.writerow(["step", "epoch", "loss", "train_acc", "val_acc", "timestamp"])
+        if not resume_path:
+            csv_writer.writerow(["step", "epoch", "loss", "train_acc", "val_acc", "timestamp"])
+
+        train_start = time.time()
+        val_acc = float("nan")
 
-        step = 0
-        for epoch in range(num_epochs):
+        for epoch in range(start_epoch, num_epochs):
             print(f"\nEpoch {epoch+1}/{num_epochs}")
-            model.train()
+            batch_in_epoch = start_batch if epoch == start_epoch else 0
+            train_sampler.set_epoch(epoch, start=batch_in_epoch * batch_size)
+            if resume_path and epoch == start_epoch:
+                model.train(state["training"])
+            else:
+                model.train()
             for batch in train_loader:
+                indices = batch.pop("index", None)
                 batch = {k: v.to(DEVICE) for k, v in batch.items()}
-                outputs = model(**batch)
-                loss = outputs.loss
-                logits = outputs.logits
-                loss.backward()
+                n = batch["labels"].shape[0]
+                mb = micro_batch_size or n
+                loss, logits_parts = 0.0, []
+                for i in range(0, n, mb):
+                    micro = {k: v[i:i + mb] for k, v in batch.items()}
+                    with torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16, enabled=bf16):
+                        outputs = model(**micro)
+                    # weight each micro-batch so the accumulated gradient is the full-batch mean
+                    micro_loss = outputs.loss * (micro["labels"].shape[0] / n)
+                    micro_loss.backward()
+                    loss = loss + micro_loss.detach()
+                    logits_parts.append(outputs.logits.detach())
+                logits = torch.cat(logits_parts)
                 optimizer.step()
                 optimizer.zero_grad()
 
                 preds = torch.argmax(logits, dim=1).cpu().numpy()
                 labels = batch["labels"].cpu().numpy()
                 train_acc = accuracy_score(labels, preds)
+                if example_stats is not None:
+                    losses = nn.functional.cross_entropy(logits.float(), batch["labels"], reduction="none")
+                    example_stats.update(indices.tolist(), losses.cpu().tolist(), (preds == labels).tolist())
 
                 # log every 5 steps
                 if step % 5 == 0:
@@ -145,6 +520,13 @@ def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_
                     log_file.write(log_line + "\n")
                     csv_writer.writerow([step, epoch, float(loss.item()), float(train_acc), float(val_acc), time.time()])
                 step += 1
+                batch_in_epoch += 1
+
+                if checkpoint_every and step % checkpoint_every == 0:
+                    checkpointer.save(step, snapshot_state(
+                        model, optimizer, step, epoch, batch_in_epoch, log_file, csvf, example_stats,
+                        train_seconds=prior_seconds + time.time() - train_start,
+                        peak_rss_mb=max(prior_peak_mb, peak_mem.peak_mb)))
 
             # end of epoch validation summary
             val_loss, val_acc, val_labels, val_preds = evaluate_loader(model, val_loader, DEVICE)
@@ -152,6 +534,41 @@ def train_one(batch_size, learning_rate, max_length, dropout, num_epochs, model_
             target_names = [str(c) for c in le.classes_]
             print(classification_report(val_labels, val_preds, target_names=target_names))
 
+    checkpointer.wait()
+    train_seconds = prior_seconds + time.time() - train_start
+    peak_rss_mb = max(prior_peak_mb, peak_mem.peak_mb)
+    memory_report = {
+        "peak_rss_mb": peak_rss_mb,
+        "batch_size": batch_size,
+        "micro_batch_size": micro_batch_size or batch_size,
+        "max_rss_mb": max_rss_mb,
+        "gradient_checkpointing": gradient_checkpointing,
+        "bf16": bf16,
+        "resumed": bool(resume_path),
+    }
+    with open(os.path.join(run_output, "memory.json"), "w") as f:
+        json.dump(memory_report, f, indent=2)
+
+    # accuracy vs. data kept, one row per run across the grid
+    data_report.update(run_name=run_name, coreset_keep=coreset_keep if coreset_stats else 1.0,
+                       final_val_acc=val_acc, train_seconds=train_seconds)
+    with open(os.path.join(run_output, "data_report.json"), "w") as f:
+        json.dump(data_report, f, indent=2)
+    report_path = os.path.join(RUNS_DIR, "data_reduction_report.csv")
+    report_rows = []
+    if os.path.exists(report_path):
+        # a rerun or resumed run replaces its earlier row
+        with open(report_path, newline="", encoding="utf-8") as f:
+            report_rows = [row for row in csv.DictReader(f) if row["run_name"] != run_name]
+    report_rows.append(data_report)
+    with open(report_path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(dict.fromkeys(k for row in report_rows for k in row)))
+        writer.writeheader()
+        writer.writerows(report_rows)
+    os.replace(report_path + ".tmp", report_path)
+    if example_stats is not None:
+        example_stats.save(os.path.join(run_output, "example_stats.csv"))
+    print(f"Peak RSS: {peak_rss_mb:.0f}MB (micro_batch_size={memory_report['micro_batch_size']})")
     print("Training finished. Saving final model.")
     save_model(model, tokenizer, le, output_dir)
 
@@ -167,4 +584,13 @@ if __name__ == "__main__":
         model_name=MODEL_NAME,
         data_file=DATA_FILE,
         output_dir=final_output,
+        resume="--resume" in sys.argv,
+        micro_batch_size=MICRO_BATCH_SIZE,
+        max_rss_mb=MAX_RSS_MB,
+        gradient_checkpointing=GRADIENT_CHECKPOINTING,
+        bf16=BF16,
+        dedupe=DEDUPLICATE,
+        collect_example_stats=COLLECT_EXAMPLE_STATS,
+        coreset_stats=CORESET_STATS,
+        coreset_keep=CORESET_KEEP,
     )
\ No newline at end of file
@@ -0,0 +1,274 @@
+import os, json, math, hashlib, argparse, time
+from collections import Counter, defaultdict
+import pandas as pd
+import torch
+from datasets import Dataset
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForSequenceClassification
+
+# === CONFIG ===
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DETOX_MODEL_DIR = os.path.join(SCRIPT_DIR, "seq2seq-detox-finetuned")
+CLASSIFIER_DIR = os.environ.get("CLASSIFIER_PATH", "ClassificationModel/final_model")
+CACHE_DIR = os.path.join(SCRIPT_DIR, "eval_cache")
+RESULTS_DIR = os.path.join(SCRIPT_DIR, "eval_results")
+MAX_LENGTH = 128              # same as init_train.py
+PROMPT_PREFIX = "detoxify: "  # same prefix app.py and reinforceTrain.py use
+TOXIC_LABEL = "1"             # label_map.json value for toxic in classifyData.csv
+DEFAULT_GEN_BATCH_SIZE = 32
+DEFAULT_CLS_BATCH_SIZE = 64
+
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+# === EVAL SPLIT ===
+def load_paradetox(main_tsv="paradetox.tsv", cannot_rewrite_tsv="paradetox_cannot_rewrite.tsv"):
+    """Same pair construction as init_train.py, so the split below matches its eval_ds."""
+    rows = []
+    main_tsv_path = os.path.join(SCRIPT_DIR, main_tsv)
+    cannot_rewrite_tsv_path = os.path.join(SCRIPT_DIR, cannot_rewrite_tsv)
+    if os.path.exists(main_tsv_path):
+        df = pd.read_csv(main_tsv_path, sep="\t", dtype=str).fillna("")
+        for _, r in df.iterrows():
+            toxic = str(r.get("toxic", "") or "").strip()
+            for col in ["neutral1", "neutral2", "neutral3"]:
+                neutral = str(r.get(col, "") or "").strip()
+                if toxic and neutral:
+                    rows.append({"toxic": toxic, "neutral": neutral})
+    if os.path.exists(cannot_rewrite_tsv_path):
+        df2 = pd.read_csv(cannot_rewrite_tsv_path, sep="\t", dtype=str).fillna("")
+        for _, r in df2.iterrows():
+            toxic = str(r.get("toxic", "") or "").strip()
+            if toxic:
+                rows.append({"toxic": toxic, "neutral": "none"})
+    return pd.DataFrame(rows)
+
+
+def load_eval_split():
+    """Unique toxic inputs of init_train.py's 5% eval split, each with its eval references.
+
+    init_train.py splits (toxic, neutral) pairs, so most eval inputs also occur in the
+    train split with other references. Those are flagged seen_in_training and scored
+    separately; references are taken from the eval pairs only.
+    """
+    df_all = load_paradetox()
+    split = Dataset.from_pandas(df_all.reset_index(drop=True)).train_test_split(test_size=0.05, seed=42)
+    train_toxic = set(split["train"]["toxic"])
+    refs = defaultdict(list)
+    for toxic, neutral in zip(split["test"]["toxic"], split["test"]["neutral"]):
+        if neutral not in refs[toxic]:
+            refs[toxic].append(neutral)
+    return [{"toxic": t, "references": refs[t], "seen_in_training": t in train_toxic} for t in sorted(refs)]
+
+
+# === GENERATION CACHE ===
+def checkpoint_hash(model_dir, gen_settings):
+    """Hash of the checkpoint files plus generation settings; keys the generation cache."""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and name.endswith((".safetensors", ".bin", ".json", ".model", ".txt")):
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    h.update(json.dumps(gen_settings, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def load_cache(cache_path):
+    cached = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    cached[rec["toxic"]] = rec["output"]
+    return cached
+
+
+def generate_missing(model, tokenizer, texts, cache_path, batch_size, num_beams):
+    """Generate rewrites for texts in length-sorted, longest-padded batches, appending each batch to the cache."""
+    texts = sorted(texts, key=len)
+    outputs = {}
+    with open(cache_path, "a", encoding="utf-8") as cache_file, torch.no_grad():
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            inputs = tokenizer([PROMPT_PREFIX + t for t in batch], return_tensors="pt", truncation=True,
+                               padding=True, max_length=MAX_LENGTH).to(DEVICE)
+            generated = model.generate(
+                **inputs,
+                max_new_tokens=max(min(int(len(t) * 1.2), 100) for t in batch),
+                num_beams=num_beams,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+            decoded = tokenizer.batch_decode(generated, skip_special_tokens=True)
+            for toxic, out in zip(batch, decoded):
+                outputs[toxic] = out.strip()
+                cache_file.write(json.dumps({"toxic": toxic, "output": outputs[toxic]}) + "\n")
+            cache_file.flush()
+            print(f"Generated {min(start + batch_size, len(texts))}/{len(texts)}")
+    return outputs
+
+
+# === SCORING ===
+def load_classifier(classifier_dir):
+    """(tokenizer, model, index of the toxic label) for classify_toxic."""
+    tokenizer = AutoTokenizer.from_pretrained(classifier_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(classifier_dir).to(DEVICE).eval()
+    with open(os.path.join(classifier_dir, "label_map.json")) as f:
+        label_map = {int(k): v for k, v in json.load(f).items()}
+    toxic_idx = next(i for i, v in label_map.items() if v == TOXIC_LABEL)
+    return tokenizer, model, toxic_idx
+
+
+def classify_toxic(texts, classifier, batch_size):
+    """Probability of the toxic label for each text, scored in length-sorted batches."""
+    tokenizer, model, toxic_idx = classifier
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    probs = [0.0] * len(texts)
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            inputs = tokenizer([texts[i] for i in idx], return_tensors="pt", truncation=True,
+                               padding=True, max_length=256).to(DEVICE)
+            p = torch.softmax(model(**inputs).logits, dim=-1)[:, toxic_idx].tolist()
+            for i, v in zip(idx, p):
+                probs[i] = v
+    return probs
+
+
+def _tokens(text):
+    return text.lower().split()
+
+
+def token_f1(hyp, refs):
+    """Best unigram F1 between the hypothesis and any reference."""
+    best = 0.0
+    h = Counter(_tokens(hyp))
+    for ref in refs:
+        r = Counter(_tokens(ref))
+        overlap = sum((h & r).values())
+        if overlap:
+            p, rc = overlap / sum(h.values()), overlap / sum(r.values())
+            best = max(best, 2 * p * rc / (p + rc))
+    return best
+
+
+def corpus_bleu(hyps, refs_list, max_n=4):
+    """Corpus BLEU-4 with multiple references and brevity penalty (no smoothing)."""
+    matches, totals = [0] * max_n, [0] * max_n
+    hyp_len = ref_len = 0
+    for hyp, refs in zip(hyps, refs_list):
+        h = _tokens(hyp)
+        rs = [_tokens(r) for r in refs]
+        hyp_len += len(h)
+        ref_len += min((abs(len(r) - len(h)), len(r)) for r in rs)[1] if rs else 0
+        for n in range(1, max_n + 1):
+            h_ngrams = Counter(tuple(h[i:i + n]) for i in range(len(h) - n + 1))
+            max_ref = Counter()
+            for r in rs:
+                max_ref |= Counter(tuple(r[i:i + n]) for i in range(len(r) - n + 1))
+            matches[n - 1] += sum((h_ngrams & max_ref).values())
+            totals[n - 1] += sum(h_ngrams.values())
+    if min(totals) == 0 or min(matches) == 0:
+        return 0.0
+    log_precision = sum(math.log(m / t) for m, t in zip(matches, totals)) / max_n
+    bp = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / max(hyp_len, 1))
+    return 100.0 * bp * math.exp(log_precision)
+
+
+def score_subset(idx, hyps, refs, out_probs, in_probs):
+    """BLEU / token F1 (and toxicity rates when the classifier ran) over the examples at idx."""
+    sub_hyps = [hyps[i] for i in idx]
+    n = max(len(idx), 1)
+    scores = {
+        "num_examples": len(idx),
+        "bleu": corpus_bleu(sub_hyps, refs),
+        "token_f1": sum(token_f1(h, r) for h, r in zip(sub_hyps, refs)) / n,
+    }
+    if out_probs is not None:
+        scores["still_toxic_rate"] = sum(out_probs[i] >= 0.5 for i in idx) / n
+        scores["input_toxic_rate"] = sum(in_probs[i] >= 0.5 for i in idx) / n
+        scores["mean_output_toxic_prob"] = sum(out_probs[i] for i in idx) / n
+    return scores
+
+
+# === MAIN ===
+def evaluate(model_dir=DETOX_MODEL_DIR, classifier_dir=CLASSIFIER_DIR, limit=None, num_beams=1,
+             gen_batch_size=DEFAULT_GEN_BATCH_SIZE, cls_batch_size=DEFAULT_CLS_BATCH_SIZE):
+    examples = load_eval_split()
+    if limit:
+        examples = examples[:limit]
+    print(f"Evaluating {len(examples)} eval inputs from {model_dir}")
+
+    gen_settings = {"num_beams": num_beams, "prefix": PROMPT_PREFIX, "max_length": MAX_LENGTH}
+    ckpt = checkpoint_hash(model_dir, gen_settings)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(CACHE_DIR, f"{ckpt}.jsonl")
+    outputs = load_cache(cache_path)
+    missing = [e["toxic"] for e in examples if e["toxic"] not in outputs]
+    print(f"Checkpoint {ckpt}: {len(outputs)} cached generations, {len(missing)} to generate")
+
+    gen_seconds = 0.0
+    if missing:
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_dir).to(DEVICE).eval()
+        start = time.time()
+        outputs.update(generate_missing(model, tokenizer, missing, cache_path, gen_batch_size, num_beams))
+        gen_seconds = time.time() - start
+        del model
+
+    hyps = [outputs[e["toxic"]] for e in examples]
+    out_probs = in_probs = None
+    if classifier_dir and os.path.isdir(classifier_dir):
+        classifier = load_classifier(classifier_dir)
+        out_probs = classify_toxic(hyps, classifier, cls_batch_size)
+        in_probs = classify_toxic([e["toxic"] for e in examples], classifier, cls_batch_size)
+        del classifier
+    else:
+        print(f"Classifier not found at {classifier_dir}; skipping toxicity scoring")
+
+    summary = {
+        "checkpoint": ckpt,
+        "model_dir": model_dir,
+        "num_examples": len(examples),
+        "generation_seconds": gen_seconds,
+    }
+    # held_out inputs never occur in the train split; only these judge generalization
+    for name, seen in (("held_out", False), ("seen", True)):
+        idx = [i for i, e in enumerate(examples) if e["seen_in_training"] == seen]
+        summary[name] = score_subset(idx, hyps, [examples[i]["references"] for i in idx], out_probs, in_probs)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{ckpt}.json")
+    with open(results_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    for k, v in summary.items():
+        if isinstance(v, dict):
+            print(f"{k}:")
+            for sk, sv in v.items():
+                print(f"  {sk}: {sv:.4f}" if isinstance(sv, float) else f"  {sk}: {sv}")
+        else:
+            print(f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}")
+    print(f"Results saved to {results_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Evaluate the detoxifier on the ParaDetox eval split.")
+    p.add_argument("--model-dir", default=DETOX_MODEL_DIR)
+    p.add_argument("--classifier-dir", default=CLASSIFIER_DIR)
+    p.add_argument("--limit", type=int, default=None, help="only evaluate the first N inputs")
+    p.add_argument("--num-beams", type=int, default=1)
+    p.add_argument("--gen-batch-size", type=int, default=DEFAULT_GEN_BATCH_SIZE)
+    p.add_argument("--cls-batch-size", type=int, default=DEFAULT_CLS_BATCH_SIZE)
+    args = p.parse_args()
+    evaluate(
+        model_dir=args.model_dir,
+        classifier_dir=args.classifier_dir,
+        limit=args.limit,
+        num_beams=args.num_beams,
+        gen_batch_size=args.gen_batch_size,
+        cls_batch_size=args.cls_batch_size,
+    )
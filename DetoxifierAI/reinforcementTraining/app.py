@@ -1,11 +1,27 @@
-from flask import Flask, request, jsonify, render_template
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from flask import Flask, request, jsonify, render_template, g, Response
+from transformers import (
+    AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForSequenceClassification, StoppingCriteria, StoppingCriteriaList
+)
+from transformers.modeling_outputs import BaseModelOutput
 import torch
 from pathlib import Path
 import json
 import os
 import subprocess
 import sys
+import time
+import atexit
+
+from metrics import (
+    REGISTRY, CONTENT_TYPE, REQUEST_LATENCY, STAGE_LATENCY, GENERATION_STEP_LATENCY, REQUESTS_TOTAL,
+    CACHE_LOOKUPS, GENERATED_TOKENS, GENERATE_CALLS, GENERATION_SECONDS, GENERATION_TOKENS_PER_SECOND,
+    IN_FLIGHT, SEMANTIC_CACHE_ENTRIES, SEMANTIC_CACHE_SAVED_SECONDS, BATCH_ITEMS, BATCH_DEDUPED,
+    SCHEDULER_RUNNING, SCHEDULER_WAITING, SCHEDULER_QUEUE_WAIT,
+)
+from profiler import SamplingProfiler
+from batching import Coalescer, run_isolated, parse_items
+from semantic_cache import SemanticCache, mean_pool, checkpoint_fingerprint, DEFAULT_CAPACITY, DEFAULT_THRESHOLD
+from scheduler import GenerationScheduler, DEFAULT_MAX_SEQUENCES, DEFAULT_MAX_TOKENS_PER_STEP
 
 app = Flask(__name__)
 
@@ -16,28 +32,313 @@ model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
 model.to("cuda" if torch.cuda.is_available() else "cpu")
 model.eval()
 
+# Optional classifier for /classify (checkpoint written by ClassificationAI/train.py save_model)
+classifier_path = os.environ.get("CLASSIFIER_PATH", "ClassificationModel/final_model")
+classifier = classifier_tokenizer = None
+classifier_labels = {}
+if os.path.isdir(classifier_path):
+    classifier_tokenizer = AutoTokenizer.from_pretrained(classifier_path)
+    classifier = AutoModelForSequenceClassification.from_pretrained(classifier_path)
+    classifier.to(model.device)
+    classifier.eval()
+    label_map_file = Path(classifier_path) / "label_map.json"
+    if label_map_file.exists():
+        with open(label_map_file, "r") as f:
+            raw_labels = {int(k): v for k, v in json.load(f).items()}
+    else:
+        raw_labels = {int(k): v for k, v in classifier.config.id2label.items()}
+    # classifyData.csv uses 1 for toxic; report the names the extension understands
+    classifier_labels = {i: "toxic" if str(v) in ("1", "toxic", "LABEL_1") else "non-toxic" for i, v in raw_labels.items()}
+
+# Batch routes
+MAX_BATCH_ITEMS = 64
+MAX_TEXT_CHARS = 5000      # same cap the extension applies
+INTERNAL_BATCH_SIZE = 16   # texts per forward pass / generate() call
+MAX_NUM_OPTIONS = 5
+coalescer = Coalescer(on_coalesced=lambda key: BATCH_DEDUPED.inc(route=key[0], scope="inflight"))
+
+# Sampling profiler: arm with POST /profile or PROFILE_REQUESTS=N at startup
+profiler = SamplingProfiler()
+if os.environ.get("PROFILE_REQUESTS"):
+    profiler.arm(int(os.environ["PROFILE_REQUESTS"]))
+
+# Optional near-duplicate reuse of rewrites, keyed on mean-pooled encoder states (SEMANTIC_CACHE=1)
+SEMANTIC_CACHE_SAVE_EVERY = 50
+semantic_cache = None
+prompt_prefix_tokens = 0
+if os.environ.get("SEMANTIC_CACHE") == "1":
+    # pool only the input text: the shared "detoxify:" tokens make short, unrelated inputs look alike
+    prefix_ids = tokenizer("detoxify:", add_special_tokens=False)["input_ids"]
+    prompt_ids = tokenizer("detoxify:")["input_ids"]
+    prompt_prefix_tokens = next(
+        (i + len(prefix_ids) for i in range(len(prompt_ids)) if prompt_ids[i:i + len(prefix_ids)] == prefix_ids), 0)
+    semantic_cache = SemanticCache(
+        dim=model.config.d_model,
+        capacity=int(os.environ.get("SEMANTIC_CACHE_SIZE", DEFAULT_CAPACITY)),
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+        path=os.environ.get("SEMANTIC_CACHE_PATH", str(Path(__file__).parent / "semantic_cache.npz")),
+        fingerprint=checkpoint_fingerprint(model_path),   # /retrain rewrites the checkpoint in place
+    )
+    SEMANTIC_CACHE_ENTRIES.set(len(semantic_cache))
+    atexit.register(semantic_cache.save)
+
+# Optional continuous batching of decoder steps across concurrent requests (GENERATION_SCHEDULER=1)
+def record_scheduler_step(seconds, new_tokens, running, waiting):
+    GENERATION_STEP_LATENCY.observe(seconds)
+    SCHEDULER_RUNNING.set(running)
+    SCHEDULER_WAITING.set(waiting)
+
+scheduler = None
+if os.environ.get("GENERATION_SCHEDULER") == "1":
+    scheduler = GenerationScheduler(
+        model,
+        max_sequences=int(os.environ.get("GENERATION_MAX_SEQUENCES", DEFAULT_MAX_SEQUENCES)),
+        max_tokens_per_step=int(os.environ.get("GENERATION_MAX_TOKENS_PER_STEP", DEFAULT_MAX_TOKENS_PER_STEP)),
+        temperature=0.9,
+        top_p=0.95,
+        on_step=record_scheduler_step,
+        on_admit=SCHEDULER_QUEUE_WAIT.observe,
+    ).start()
+    atexit.register(scheduler.close)
+
+class StepTimer(StoppingCriteria):
+    """Never stops generation; records the time of each decoder step."""
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.perf_counter()
+        GENERATION_STEP_LATENCY.observe(now - self.last)
+        self.last = now
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class RowTokenBudget(StoppingCriteria):
+    """Finishes each row of a batched generate() at its own max_new_tokens."""
+    def __init__(self, budgets, device):
+        self.budgets = torch.tensor(budgets, device=device)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # first position is the decoder start token, not a generated one
+        return (input_ids.shape[-1] - 1) >= self.budgets
+
+def record_semantic_lookup(hit, num_options):
+    CACHE_LOOKUPS.inc(cache="semantic", result="hit" if hit else "miss")
+    calls = GENERATE_CALLS.get()
+    if hit and calls:
+        SEMANTIC_CACHE_SAVED_SECONDS.inc(GENERATION_SECONDS.get() / calls * num_options)
+
+def remember_rewrites(text, embedding, rewrites):
+    semantic_cache.add(text, embedding, rewrites)
+    SEMANTIC_CACHE_ENTRIES.set(len(semantic_cache))
+    if semantic_cache.inserts_since_save >= SEMANTIC_CACHE_SAVE_EVERY:
+        semantic_cache.save()
+
+def generate_scheduled(texts, last_hidden_state, attention_mask, num_options):
+    """Decode each row through the scheduler with its own token budget; num_options rewrites per row."""
+    start = time.perf_counter()
+    futures = [
+        scheduler.submit(last_hidden_state[i], attention_mask[i], min(int(len(t) * 1.2), 100), num_sequences=num_options)
+        for i, t in enumerate(texts)
+    ]
+    outputs = [seq for f in futures for seq in f.result()]
+    elapsed = time.perf_counter() - start
+    STAGE_LATENCY.observe(elapsed, stage="generate")
+    new_tokens = sum(len(seq) for seq in outputs)
+    GENERATED_TOKENS.inc(new_tokens)
+    GENERATE_CALLS.inc(len(outputs))
+    GENERATION_SECONDS.inc(elapsed)
+    if elapsed > 0:
+        GENERATION_TOKENS_PER_SECOND.set(new_tokens / elapsed)
+    with STAGE_LATENCY.time(stage="decode"):
+        decoded = [d.strip() for d in tokenizer.batch_decode(outputs, skip_special_tokens=True)]
+    return [decoded[i * num_options:(i + 1) * num_options] for i in range(len(texts))]
+
 # Detoxification function (generate multiple options for DPO preference)
 def generate_responses(toxic_input, num_options=3):
     """Generate multiple detoxified options for user to choose best one."""
     prompt = f"detoxify: {toxic_input}"
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding="max_length", max_length=512).to(model.device)
+    with STAGE_LATENCY.time(stage="tokenize"):
+        inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding="max_length", max_length=512).to(model.device)
     
     responses = []
     with torch.no_grad():
-        for _ in range(num_options):
-            output = model.generate(
-                **inputs,
-                max_new_tokens=min(int(len(toxic_input) * 1.2), 100),
-                temperature=0.9,  # Higher temperature for diversity
-                top_p=0.95,
-                do_sample=True,
-                pad_token_id=tokenizer.pad_token_id
-            )
-            decoded = tokenizer.decode(output[0], skip_special_tokens=True)
-            responses.append(decoded.strip())
+        # Encoder output does not depend on sampling, so run it once for all options
+        with STAGE_LATENCY.time(stage="encode"):
+            encoder_outputs = model.get_encoder()(**inputs)
+
+        if semantic_cache is not None:
+            with STAGE_LATENCY.time(stage="semantic_lookup"):
+                embedding = mean_pool(encoder_outputs.last_hidden_state, inputs["attention_mask"], prompt_prefix_tokens)[0]
+                hit = semantic_cache.lookup(embedding, min_rewrites=num_options)
+            record_semantic_lookup(hit, num_options)
+            if hit:
+                return hit[0][:num_options]
+
+        if scheduler is not None:
+            responses = generate_scheduled([toxic_input], encoder_outputs.last_hidden_state, inputs["attention_mask"], num_options)[0]
+        else:
+            for _ in range(num_options):
+                step_timer = StepTimer()
+                start = time.perf_counter()
+                output = model.generate(
+                    encoder_outputs=encoder_outputs,
+                    attention_mask=inputs["attention_mask"],
+                    max_new_tokens=min(int(len(toxic_input) * 1.2), 100),
+                    temperature=0.9,  # Higher temperature for diversity
+                    top_p=0.95,
+                    do_sample=True,
+                    pad_token_id=tokenizer.pad_token_id,
+                    stopping_criteria=StoppingCriteriaList([step_timer])
+                )
+                elapsed = time.perf_counter() - start
+                STAGE_LATENCY.observe(elapsed, stage="generate")
+                # first position is the decoder start token, not a generated one
+                new_tokens = output.shape[-1] - 1
+                GENERATED_TOKENS.inc(new_tokens)
+                GENERATE_CALLS.inc()
+                GENERATION_SECONDS.inc(elapsed)
+                if elapsed > 0:
+                    GENERATION_TOKENS_PER_SECOND.set(new_tokens / elapsed)
+                with STAGE_LATENCY.time(stage="decode"):
+                    decoded = tokenizer.decode(output[0], skip_special_tokens=True)
+                responses.append(decoded.strip())
+
+    if semantic_cache is not None:
+        remember_rewrites(toxic_input, embedding, responses)
     
     return responses
 
+# Batched inference for the /classify and /detoxify routes
+def classify_texts(texts):
+    """Classify texts in one padded forward pass."""
+    with STAGE_LATENCY.time(stage="classify"):
+        inputs = classifier_tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=256).to(model.device)
+        with torch.no_grad():
+            probs = torch.softmax(classifier(**inputs).logits, dim=-1).tolist()
+    results = []
+    for p in probs:
+        confidence = {classifier_labels[i]: v for i, v in enumerate(p)}
+        results.append({"classification": max(confidence, key=confidence.get), "confidence": confidence})
+    return results
+
+def detoxify_texts(texts, num_options=1):
+    """Batched generate_responses: one padded encoder pass and one generate() call for all texts."""
+    prompts = [f"detoxify: {t}" for t in texts]
+    with STAGE_LATENCY.time(stage="tokenize"):
+        inputs = tokenizer(prompts, return_tensors="pt", truncation=True, padding=True, max_length=512).to(model.device)
+    results = [None] * len(texts)
+    with torch.no_grad():
+        with STAGE_LATENCY.time(stage="encode"):
+            encoder_outputs = model.get_encoder()(**inputs)
+
+        todo = list(range(len(texts)))
+        if semantic_cache is not None:
+            with STAGE_LATENCY.time(stage="semantic_lookup"):
+                embeddings = mean_pool(encoder_outputs.last_hidden_state, inputs["attention_mask"], prompt_prefix_tokens)
+                hits = [semantic_cache.lookup(e, min_rewrites=num_options) for e in embeddings]
+            todo = []
+            for i, hit in enumerate(hits):
+                record_semantic_lookup(hit, num_options)
+                if hit:
+                    results[i] = hit[0][:num_options]
+                else:
+                    todo.append(i)
+        if not todo:
+            return results
+
+        if scheduler is not None:
+            rows = torch.tensor(todo, device=model.device)
+            decoded = generate_scheduled([texts[i] for i in todo], encoder_outputs.last_hidden_state[rows],
+                                         inputs["attention_mask"][rows], num_options)
+            for j, i in enumerate(todo):
+                results[i] = decoded[j]
+                if semantic_cache is not None:
+                    remember_rewrites(texts[i], embeddings[i], results[i])
+            return results
+
+        rows = torch.tensor(todo, device=model.device)
+        # same per-text limit as generate_responses; rows with a smaller one stop early
+        budgets = [min(int(len(texts[i]) * 1.2), 100) for i in todo for _ in range(num_options)]
+        start = time.perf_counter()
+        output = model.generate(
+            encoder_outputs=BaseModelOutput(last_hidden_state=encoder_outputs.last_hidden_state[rows]),
+            attention_mask=inputs["attention_mask"][rows],
+            max_new_tokens=max(budgets),
+            temperature=0.9,
+            top_p=0.95,
+            do_sample=True,
+            num_return_sequences=num_options,
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=StoppingCriteriaList([StepTimer(), RowTokenBudget(budgets, model.device)])
+        )
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage="generate")
+        new_tokens = int((output[:, 1:] != tokenizer.pad_token_id).sum().item())
+        GENERATED_TOKENS.inc(new_tokens)
+        GENERATE_CALLS.inc(len(todo) * num_options)
+        GENERATION_SECONDS.inc(elapsed)
+        if elapsed > 0:
+            GENERATION_TOKENS_PER_SECOND.set(new_tokens / elapsed)
+        with STAGE_LATENCY.time(stage="decode"):
+            decoded = [d.strip() for d in tokenizer.batch_decode(output, skip_special_tokens=True)]
+
+    for j, i in enumerate(todo):
+        results[i] = decoded[j * num_options:(j + 1) * num_options]
+        if semantic_cache is not None:
+            remember_rewrites(texts[i], embeddings[i], results[i])
+    return results
+
+def handle_batch(route, batch_fn, format_result, options=()):
+    """Shared body of the batch routes.
+
+    Accepts {"text": ...} (single text, the extension's current format) or
+    {"items": [{"id": ..., "text": ...}, ...]}. Identical texts are computed once, also
+    across concurrent requests, and every item gets its own result or error.
+    """
+    data = request.get_json(silent=True) or {}
+    single = isinstance(data.get("text"), str)
+    if single:
+        if not data["text"].strip():
+            return jsonify({"error": "Missing text"}), 400
+        items = [{"id": 0, "text": data["text"].strip()[:MAX_TEXT_CHARS]}]
+    else:
+        items, error = parse_items(data, MAX_BATCH_ITEMS, MAX_TEXT_CHARS)
+        if error:
+            return jsonify({"error": error}), 400
+
+    texts = [item["text"] for item in items if "text" in item]
+    unique = list(dict.fromkeys(texts))
+    if len(unique) < len(texts):
+        BATCH_DEDUPED.inc(len(texts) - len(unique), route=route, scope="batch")
+
+    def compute(keys):
+        # length-sorted so each internal batch pads as little as possible
+        ordered = sorted((k[-1] for k in keys), key=len)
+        by_text = run_isolated(ordered, batch_fn, INTERNAL_BATCH_SIZE)
+        return {k: by_text[k[-1]] for k in keys}
+
+    computed = coalescer.run([(route,) + tuple(options) + (t,) for t in unique], compute)
+
+    results = []
+    for item in items:
+        if "error" in item:
+            results.append({"id": item["id"], "ok": False, "error": item["error"]})
+            continue
+        result = computed[(route,) + tuple(options) + (item["text"],)]
+        if isinstance(result, Exception):
+            results.append({"id": item["id"], "ok": False, "error": str(result) or type(result).__name__})
+        else:
+            results.append({"id": item["id"], "ok": True, **format_result(result)})
+    for r in results:
+        BATCH_ITEMS.inc(route=route, result="ok" if r["ok"] else "error")
+
+    if single:
+        r = results[0]
+        if not r["ok"]:
+            return jsonify({"error": r["error"]}), 500
+        return jsonify({k: v for k, v in r.items() if k not in ("id", "ok")})
+    return jsonify({"results": results})
+
 # Preference saving for DPO
 def save_preference(toxic_input, chosen_response, rejected_responses):
     """Save user preference (chosen vs rejected) for DPO training."""
@@ -48,24 +349,51 @@ def save_preference(toxic_input, chosen_response, rejected_responses):
     }
     prefs_file = Path(__file__).parent / "user_preferences.json"
     
-    # Load existing preferences or create new list
-    preferences = []
-    if prefs_file.exists():
-        try:
-            with open(prefs_file, "r") as f:
-                preferences = json.load(f)
-        except:
-            preferences = []
-    
-    # Append new preference
-    preferences.append(preference)
-    
-    # Save back to file
-    with open(prefs_file, "w") as f:
-        json.dump(preferences, f, indent=2)
+    with STAGE_LATENCY.time(stage="save_preference"):
+        # Load existing preferences or create new list
+        preferences = []
+        if prefs_file.exists():
+            try:
+                with open(prefs_file, "r") as f:
+                    preferences = json.load(f)
+            except:
+                preferences = []
+        
+        # Append new preference
+        preferences.append(preference)
+        
+        # Save back to file
+        with open(prefs_file, "w") as f:
+            json.dump(preferences, f, indent=2)
     
     return len(preferences)
 
+# Request instrumentation
+UNPROFILED_ROUTES = {"/metrics", "/profile"}
+
+def route_label():
+    # the URL rule, not the raw path, so unknown URLs cannot create unbounded label sets
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.profiled = request.path not in UNPROFILED_ROUTES and profiler.request_started()
+    IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_status(response):
+    REQUESTS_TOTAL.inc(route=route_label(), status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    IN_FLIGHT.dec()
+    if "request_start" in g:
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_start, route=route_label())
+    if g.get("profiled"):
+        profiler.request_finished()
+
 # Routes
 @app.route("/", methods=["GET", "POST"])
 def home():
@@ -150,6 +478,70 @@ def retrain_model():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/classify", methods=["POST"])
+def classify():
+    """Toxicity classification for one text or a batch of {id, text} items."""
+    if classifier is None:
+        return jsonify({"error": f"No classifier loaded (looked in {classifier_path})"}), 503
+    return handle_batch("classify", classify_texts, lambda r: r)
+
+@app.route("/detoxify", methods=["POST"])
+def detoxify():
+    """Detoxified rewrites for one text or a batch of {id, text} items."""
+    data = request.get_json(silent=True) or {}
+    try:
+        num_options = int(data.get("num_options", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "num_options must be an integer"}), 400
+    if not 1 <= num_options <= MAX_NUM_OPTIONS:
+        return jsonify({"error": f"num_options must be between 1 and {MAX_NUM_OPTIONS}"}), 400
+    return handle_batch(
+        "detoxify",
+        lambda texts: detoxify_texts(texts, num_options=num_options),
+        lambda r: {"detoxified": r},
+        options=(num_options,),
+    )
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition of serving metrics."""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit rate, size and lookup latency of the semantic rewrite cache."""
+    if semantic_cache is None:
+        return jsonify({"enabled": False})
+    stats = semantic_cache.stats()
+    stats["enabled"] = True
+    stats["saved_generation_seconds"] = SEMANTIC_CACHE_SAVED_SECONDS.get()
+    return jsonify(stats)
+
+@app.route("/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    """Running and waiting sequences of the continuous-batching scheduler."""
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    stats = scheduler.stats()
+    stats["enabled"] = True
+    return jsonify(stats)
+
+@app.route("/profile", methods=["POST"])
+def arm_profiler():
+    """Capture a sampling stack profile of the next N requests (JSON body: {"requests": N})."""
+    data = request.get_json(silent=True) or {}
+    try:
+        num_requests = int(data.get("requests", 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "requests must be an integer"}), 400
+    if num_requests < 1:
+        return jsonify({"error": "requests must be at least 1"}), 400
+    profiler.arm(num_requests)
+    return jsonify({
+        "success": True,
+        "message": f"Profiling the next {num_requests} request(s); output goes to {profiler.output_dir}"
+    })
+
 
 if __name__ == "__main__":
     app.run(debug=False)
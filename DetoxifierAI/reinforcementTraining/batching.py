@@ -0,0 +1,105 @@
+import json
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+# Request coalescing for the batch routes: identical texts inside one batch, or already
+# being computed for another in-flight batch, are computed once and shared.
+
+
+class Coalescer:
+    def __init__(self, on_coalesced=None):
+        self._lock = threading.Lock()
+        self._inflight = {}   # key -> Future
+        self.on_coalesced = on_coalesced
+
+    def run(self, keys, compute):
+        """Return {key: result or Exception} for the unique keys.
+
+        compute(keys) gets only the keys no other caller is already computing and must
+        return {key: result or Exception}. Keys it misses resolve to a KeyError.
+        """
+        owned, futures = [], {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    owned.append(key)
+                elif self.on_coalesced is not None:
+                    self.on_coalesced(key)
+                futures[key] = future
+
+        if owned:
+            try:
+                results = compute(owned)
+            except Exception as e:
+                results = {key: e for key in owned}
+            with self._lock:
+                for key in owned:
+                    result = results.get(key, KeyError(key))
+                    if isinstance(result, Exception):
+                        futures[key].set_exception(result)
+                    else:
+                        futures[key].set_result(result)
+                    del self._inflight[key]
+
+        out = {}
+        for key, future in futures.items():
+            try:
+                out[key] = future.result()
+            except Exception as e:
+                out[key] = e
+        return out
+
+
+def run_isolated(keys, batch_fn, batch_size):
+    """Run batch_fn over keys in chunks; if a chunk fails, retry its items one by one.
+
+    One bad item then only fails itself. Returns {key: result or Exception}.
+    """
+    results = {}
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        try:
+            results.update(zip(chunk, batch_fn(chunk)))
+        except Exception:
+            for key in chunk:
+                try:
+                    results[key] = batch_fn([key])[0]
+                except Exception as e:
+                    results[key] = e
+    return results
+
+
+def parse_items(data, max_items, max_chars):
+    """Validate a batch body {"items": [{"id": ..., "text": ...}, ...]}.
+
+    Returns (items, error). Bad items are returned with an "error" field instead of
+    failing the whole request; error is only set when the body itself is unusable.
+    Clients match results by id, so every item sharing an id gets an error.
+    """
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, "Body must be {\"items\": [{\"id\": ..., \"text\": ...}, ...]}"
+    if len(items) > max_items:
+        return None, f"At most {max_items} items per request"
+    parsed = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"id": i, "text": item}
+        if not isinstance(item, dict):
+            parsed.append({"id": i, "error": "Item must be an object with id and text"})
+            continue
+        item_id = item.get("id", i)
+        text = item.get("text")
+        if not isinstance(text, str) or not text.strip():
+            parsed.append({"id": item_id, "error": "Missing text"})
+        else:
+            parsed.append({"id": item_id, "text": text.strip()[:max_chars]})
+    id_counts = Counter(json.dumps(item["id"], sort_keys=True) for item in parsed)
+    for item in parsed:
+        if id_counts[json.dumps(item["id"], sort_keys=True)] > 1:
+            item.pop("text", None)
+            item["error"] = "Duplicate id"
+    return parsed, None
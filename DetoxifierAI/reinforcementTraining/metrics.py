@@ -0,0 +1,190 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4), no extra dependency.
+
+# Latency buckets in seconds, from sub-millisecond decode steps up to full generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra) if extra else [])
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_one(key, value))
+        return lines
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_one(self, key, state):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _fmt_labels(self.labelnames, key, [("le", _fmt_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        base = _fmt_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{base} {_fmt_value(state['sum'])}")
+        lines.append(f"{self.name}_count{base} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name, doc, labelnames=()):
+        return self.register(Gauge(name, doc, labelnames))
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REGISTRY = Registry()
+
+# === Serving metrics ===
+REQUEST_LATENCY = REGISTRY.histogram(
+    "detox_request_duration_seconds", "End-to-end request latency by route.", ["route"])
+STAGE_LATENCY = REGISTRY.histogram(
+    "detox_stage_duration_seconds",
+    "Time spent per hot-path stage (tokenize, encode, generate, decode, save_preference).", ["stage"])
+GENERATION_STEP_LATENCY = REGISTRY.histogram(
+    "detox_generation_step_duration_seconds", "Time per decoder step inside generate().",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5))
+REQUESTS_TOTAL = REGISTRY.counter(
+    "detox_requests_total", "Requests handled by route and HTTP status.", ["route", "status"])
+CACHE_LOOKUPS = REGISTRY.counter(
+    "detox_cache_lookups_total", "Cache lookups by cache name and result (hit/miss).", ["cache", "result"])
+GENERATED_TOKENS = REGISTRY.counter(
+    "detox_generated_tokens_total", "Decoder tokens produced by generate().")
+GENERATE_CALLS = REGISTRY.counter(
+    "detox_generate_calls_total", "Calls to generate() (one per returned option).")
+GENERATION_SECONDS = REGISTRY.counter(
+    "detox_generation_seconds_total", "Wall time spent inside generate(); tokens/sec = tokens_total / seconds_total.")
+GENERATION_TOKENS_PER_SECOND = REGISTRY.gauge(
+    "detox_generation_tokens_per_second", "Generated tokens/sec of the most recent request.")
+IN_FLIGHT = REGISTRY.gauge(
+    "detox_requests_in_flight", "Requests currently being processed (queue depth).")
+SEMANTIC_CACHE_ENTRIES = REGISTRY.gauge(
+    "detox_semantic_cache_entries", "Entries in the near-duplicate rewrite index.")
+SEMANTIC_CACHE_SAVED_SECONDS = REGISTRY.counter(
+    "detox_semantic_cache_saved_seconds_total",
+    "Estimated generate() time avoided by semantic cache hits (average generate time x options).")
+BATCH_ITEMS = REGISTRY.counter(
+    "detox_batch_items_total", "Items received by the batch routes, by route and outcome (ok/error).", ["route", "result"])
+BATCH_DEDUPED = REGISTRY.counter(
+    "detox_batch_deduplicated_total",
+    "Items answered without their own computation: duplicate in the same batch or already in flight.", ["route", "scope"])
+SCHEDULER_RUNNING = REGISTRY.gauge(
+    "detox_scheduler_running_sequences", "Sequences in the continuous-batching decode batch.")
+SCHEDULER_WAITING = REGISTRY.gauge(
+    "detox_scheduler_waiting_sequences", "Sequences queued for a free decode slot.")
+SCHEDULER_QUEUE_WAIT = REGISTRY.histogram(
+    "detox_scheduler_queue_wait_seconds", "Time a sequence waited before joining the decode batch.")
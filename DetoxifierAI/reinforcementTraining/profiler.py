@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# Opt-in sampling profiler. arm(n) captures stack samples of the threads serving
+# the next n requests and writes them as collapsed stacks (one "frame;frame;... count"
+# line per unique stack), which flamegraph.pl / speedscope can open directly.
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, interval=DEFAULT_INTERVAL):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._active = {}        # thread id -> number of active profiled requests
+        self._samples = Counter()
+        self._captured = 0
+        self._sampler = None
+        self._stop = None        # stop event of the current sampler thread
+
+    @property
+    def armed(self):
+        with self._lock:
+            return self._remaining > 0 or bool(self._active)
+
+    def arm(self, num_requests):
+        """Profile the next num_requests requests; the profile is written when the last one finishes."""
+        with self._lock:
+            self._remaining = max(0, int(num_requests))
+            self._samples.clear()
+            self._captured = 0
+            if self._remaining and self._sampler is None:
+                # each sampler gets its own event, so one that is still winding down after
+                # the previous profile can never be revived alongside the new one
+                self._stop = threading.Event()
+                self._sampler = threading.Thread(target=self._run, args=(self._stop,), name="sampling-profiler", daemon=True)
+                self._sampler.start()
+
+    def request_started(self):
+        """Called at the start of a request; returns True if this request is being profiled."""
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            tid = threading.get_ident()
+            self._active[tid] = self._active.get(tid, 0) + 1
+            return True
+
+    def request_finished(self):
+        """Called when a profiled request ends; returns the profile path once all requests are done."""
+        with self._lock:
+            tid = threading.get_ident()
+            self._active[tid] -= 1
+            if self._active[tid] == 0:
+                del self._active[tid]
+            self._captured += 1
+            if self._remaining > 0 or self._active:
+                return None
+            samples, captured = dict(self._samples), self._captured
+            self._samples.clear()
+            self._stop.set()
+            self._sampler = None
+        return self._write(samples, captured)
+
+    def _run(self, stop):
+        while not stop.is_set():
+            with self._lock:
+                tids = list(self._active)
+            if tids:
+                frames = sys._current_frames()
+                for tid in tids:
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        stack = self._collapse(frame)
+                        with self._lock:
+                            self._samples[stack] += 1
+            stop.wait(self.interval)
+
+    @staticmethod
+    def _collapse(frame):
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _write(self, samples, captured):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile_{time.strftime('%Y%m%d-%H%M%S')}_{captured}req.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(samples.items(), key=lambda kv: -kv[1]):
+                f.write(f"{stack} {count}\n")
+        print(f"Profile of {captured} request(s) written to {path}")
+        return path
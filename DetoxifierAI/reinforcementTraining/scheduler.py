@@ -0,0 +1,394 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+import torch
+from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+from transformers.modeling_outputs import BaseModelOutput
+
+# Continuous batching for the seq2seq detoxifier. Every sequence keeps its own encoder
+# output and decoder KV cache. Each step runs one decoder token for all running sequences,
+# retires the ones that hit EOS or their max_new_tokens, and admits waiting sequences into
+# the freed slots, so a short rewrite never waits for the longest one it shares a batch with.
+
+DEFAULT_MAX_SEQUENCES = 16
+DEFAULT_MAX_TOKENS_PER_STEP = 2048
+TOP_P_CANDIDATES = 256
+
+# generation_config settings the step loop cannot apply, with their no-op values
+UNSUPPORTED_SETTINGS = {
+    "num_beams": 1, "diversity_penalty": 0.0, "encoder_no_repeat_ngram_size": 0, "bad_words_ids": None,
+    "suppress_tokens": None, "begin_suppress_tokens": None, "sequence_bias": None, "typical_p": 1.0,
+    "epsilon_cutoff": 0.0, "eta_cutoff": 0.0, "min_p": None,
+}
+
+
+def _banned_ngram_tokens(history, n):
+    """Tokens that would repeat an n-gram already in history (no_repeat_ngram_size)."""
+    if len(history) + 1 < n:
+        return []
+    prefix = history[len(history) - n + 1:]
+    return [history[j + n - 1] for j in range(len(history) - n + 1) if history[j:j + n - 1] == prefix]
+
+
+class _Request:
+    def __init__(self, num_sequences):
+        self.future = Future()
+        self.outputs = [None] * num_sequences
+        self.remaining = num_sequences
+
+
+class _Sequence:
+    def __init__(self, request, index, encoder_hidden, max_new_tokens):
+        self.request = request
+        self.index = index                    # position in request.outputs
+        self.encoder_hidden = encoder_hidden  # (src_len, d_model), no padding
+        self.max_new_tokens = max_new_tokens
+        self.tokens = []                      # generated ids, without the decoder start token
+        self.cache = None                     # per layer (self_k, self_v, cross_k, cross_v), batch dim 1
+        self.submitted = time.perf_counter()
+
+
+class GenerationScheduler:
+    """Background decode loop shared by all requests.
+
+    max_sequences caps the running decode batch. max_tokens_per_step caps the work of one
+    step: each running sequence costs one token, and admitting a sequence costs its
+    encoder length (its cross-attention keys/values are computed on admission). A waiting
+    sequence is always admitted when nothing is running, whatever its length.
+
+    Sampling uses the temperature / top-p passed in, like generate_responses, plus what
+    model.generate() takes from the model's generation_config: top_k, no_repeat_ngram_size,
+    repetition_penalty, min_length / min_new_tokens and forced BOS/EOS. Settings it cannot
+    apply (beam search among them) are reported with a warning at construction, since
+    scheduled rewrites then differ from the non-scheduler path.
+    """
+
+    def __init__(self, model, max_sequences=DEFAULT_MAX_SEQUENCES, max_tokens_per_step=DEFAULT_MAX_TOKENS_PER_STEP,
+                 temperature=0.9, top_p=0.95, do_sample=True, on_step=None, on_admit=None):
+        self.model = model
+        self.max_sequences = max_sequences
+        self.max_tokens_per_step = max_tokens_per_step
+        self.temperature = temperature
+        self.top_p = top_p
+        self.do_sample = do_sample
+        self.on_step = on_step      # on_step(seconds, new_tokens, running, waiting)
+        self.on_admit = on_admit    # on_admit(queue_wait_seconds), once per admitted sequence
+
+        config = model.config
+        generation_config = getattr(model, "generation_config", None)
+        self.decoder_start_token_id = config.decoder_start_token_id
+        self.pad_token_id = config.pad_token_id
+        self.eos_token_id = config.eos_token_id
+        def setting(name, default):
+            value = getattr(generation_config, name, None)
+            return default if value is None else value
+
+        self.forced_bos_token_id = setting("forced_bos_token_id", None)
+        self.forced_eos_token_id = setting("forced_eos_token_id", None)
+        self.top_k = setting("top_k", 50)   # generate()'s default when unset
+        self.no_repeat_ngram_size = setting("no_repeat_ngram_size", 0)
+        self.repetition_penalty = setting("repetition_penalty", 1.0)
+        self.min_length = setting("min_length", 0)
+        self.min_new_tokens = setting("min_new_tokens", 0)
+        unsupported = [f"{name}={setting(name, default)}" for name, default in UNSUPPORTED_SETTINGS.items()
+                       if setting(name, default) != default]
+        if unsupported:
+            print(f"Warning: the generation scheduler cannot apply {', '.join(unsupported)} from the model's "
+                  "generation_config; scheduled rewrites will differ from model.generate()")
+
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._running = []        # sequences in the current decode batch, in batch order
+        self._batch = None        # padded tensors and cache for self._running
+        self._stopped = False
+        self._thread = None
+
+        # BART adds learned absolute positions computed from the (shared) cache length;
+        # sequences in one batch sit at different positions, so feed each row its own.
+        self._local = threading.local()
+        embed_positions = getattr(model.get_decoder(), "embed_positions", None)
+        if embed_positions is not None:
+            embed_positions.register_forward_hook(self._position_hook)
+
+    def _position_hook(self, module, args, output):
+        positions = getattr(self._local, "positions", None)
+        if positions is None:
+            return output
+        weight = module.weight
+        return torch.nn.functional.embedding(positions + getattr(module, "offset", 0), weight).unsqueeze(1)
+
+    # === Client side ===
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            waiting, self._waiting = list(self._waiting), deque()
+            self._cond.notify_all()
+        for seq in waiting:
+            self._fail(seq, RuntimeError("Generation scheduler stopped"))
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, encoder_hidden, attention_mask, max_new_tokens, num_sequences=1):
+        """Queue one input; the future resolves to num_sequences lists of generated token ids.
+
+        encoder_hidden is (src_len, d_model) for a single row; attention_mask drops its padding.
+        """
+        encoder_hidden = encoder_hidden[attention_mask.bool()] if attention_mask is not None else encoder_hidden
+        request = _Request(num_sequences)
+        seqs = [_Sequence(request, i, encoder_hidden, max(1, int(max_new_tokens))) for i in range(num_sequences)]
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Generation scheduler stopped")
+            self._waiting.extend(seqs)
+            self._cond.notify()
+        return request.future
+
+    def stats(self):
+        with self._cond:
+            return {"running": len(self._running), "waiting": len(self._waiting),
+                    "max_sequences": self.max_sequences, "max_tokens_per_step": self.max_tokens_per_step}
+
+    # === Decode loop ===
+    def _loop(self):
+        try:
+            with torch.no_grad():
+                while self._step():
+                    pass
+        finally:
+            # however the loop ended, no caller may be left waiting on a future
+            with self._cond:
+                self._stopped = True
+                pending = self._running + list(self._waiting)
+                self._waiting.clear()
+            self._running, self._batch = [], None
+            for seq in pending:
+                self._fail(seq, RuntimeError("Generation scheduler stopped"))
+
+    def _step(self):
+        """Admit, decode one token for every running sequence; False once stopped."""
+        admitted = self._admit()
+        if admitted is None:
+            return False
+        start = time.perf_counter()
+        running = list(self._running)
+        try:
+            if running:
+                self._decode()
+            if admitted:
+                self._prefill(admitted)
+        except Exception as e:
+            for seq in running + admitted:
+                self._fail(seq, e)
+            self._running, self._batch = [], None
+            return True
+        with self._cond:
+            waiting = len(self._waiting)
+        self._notify(self.on_step, time.perf_counter() - start, len(running) + len(admitted), len(self._running), waiting)
+        return True
+
+    @staticmethod
+    def _notify(callback, *args):
+        # metrics callbacks must never take the decode loop down with them
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Generation scheduler callback failed: {e!r}")
+
+    def _admit(self):
+        """Pop the waiting sequences that fit this step; None once the scheduler is stopped."""
+        with self._cond:
+            while not self._running and not self._waiting and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            budget = self.max_tokens_per_step - len(self._running)
+            admitted = []
+            while self._waiting and len(self._running) + len(admitted) < self.max_sequences:
+                cost = self._waiting[0].encoder_hidden.shape[0]
+                if cost > budget and (self._running or admitted):
+                    break
+                budget -= cost
+                admitted.append(self._waiting.popleft())
+        now = time.perf_counter()
+        for seq in admitted:
+            self._notify(self.on_admit, now - seq.submitted)
+        return admitted
+
+    def _prefill(self, seqs):
+        """First decoder step for newly admitted sequences; computes their cross-attention cache."""
+        enc, enc_mask = self._pad_encoder(seqs)
+        device = enc.device
+        cache = EncoderDecoderCache(DynamicCache(), DynamicCache())
+        out = self._forward(seqs, enc, enc_mask, torch.ones(len(seqs), 1, dtype=torch.long, device=device), cache)
+        layers = self._layers(out.past_key_values)
+        self._unpack_batch()
+        for b, seq in enumerate(seqs):
+            src_len = seq.encoder_hidden.shape[0]
+            seq.cache = [(sk[b:b + 1], sv[b:b + 1], ck[b:b + 1, :, :src_len], cv[b:b + 1, :, :src_len])
+                         for sk, sv, ck, cv in layers]
+        self._running.extend(seqs)
+        self._retire(seqs, self._sample(seqs, out.logits[:, -1, :]))
+
+    def _decode(self):
+        """One decoder step for every running sequence."""
+        if self._batch is None:
+            self._pack_batch()
+        batch = self._batch
+        batch["decoder_mask"] = torch.cat([batch["decoder_mask"], batch["decoder_mask"].new_ones(len(self._running), 1)], dim=1)
+        out = self._forward(self._running, batch["enc"], batch["enc_mask"], batch["decoder_mask"], batch["cache"])
+        batch["cache"] = out.past_key_values
+        self._retire(self._running, self._sample(self._running, out.logits[:, -1, :]))
+
+    def _forward(self, seqs, enc, enc_mask, decoder_mask, cache):
+        device = enc.device
+        last = [seq.tokens[-1] if seq.tokens else self.decoder_start_token_id for seq in seqs]
+        self._local.positions = torch.tensor([len(seq.tokens) for seq in seqs], device=device)
+        try:
+            return self.model(
+                encoder_outputs=BaseModelOutput(last_hidden_state=enc),
+                attention_mask=enc_mask,
+                decoder_input_ids=torch.tensor(last, device=device).unsqueeze(1),
+                decoder_attention_mask=decoder_mask,
+                past_key_values=cache,
+                use_cache=True,
+            )
+        finally:
+            self._local.positions = None
+
+    def _process(self, seqs, logits):
+        """The generation_config logits processors, per row over the decoder start token + tokens."""
+        for i, seq in enumerate(seqs):
+            history = [self.decoder_start_token_id] + seq.tokens
+            if self.eos_token_id is not None and (len(history) < self.min_length or len(seq.tokens) < self.min_new_tokens):
+                logits[i, self.eos_token_id] = float("-inf")
+            if self.repetition_penalty != 1.0:
+                idx = torch.tensor(history, device=logits.device)
+                scores = logits[i, idx]
+                logits[i, idx] = torch.where(scores < 0, scores * self.repetition_penalty, scores / self.repetition_penalty)
+            if self.no_repeat_ngram_size:
+                banned = _banned_ngram_tokens(history, self.no_repeat_ngram_size)
+                if banned:
+                    logits[i, banned] = float("-inf")
+        return logits
+
+    def _sample(self, seqs, logits):
+        logits = self._process(seqs, logits.float())
+        if not self.do_sample:
+            next_tokens = logits.argmax(dim=-1).tolist()
+        else:
+            logits = logits / self.temperature
+            vocab = logits.shape[-1]
+            if self.top_k and self.top_k < vocab:
+                # top-p then runs over the renormalized top_k, as in generate()
+                cand_logits, cand_idx = logits.topk(self.top_k, dim=-1)
+                probs = torch.softmax(cand_logits, dim=-1)
+            else:
+                # top-p over the top candidates instead of sorting the whole vocabulary; exact as
+                # long as they hold top_p of the mass, otherwise fall back to a full sort
+                full = torch.softmax(logits, dim=-1)
+                probs, cand_idx = full.topk(min(TOP_P_CANDIDATES, vocab), dim=-1)
+                if self.top_p >= 1.0 or bool((probs.sum(dim=-1) < self.top_p).any()):
+                    probs, cand_idx = full.sort(dim=-1, descending=True)
+            if self.top_p < 1.0:
+                # keep the smallest prefix whose mass reaches top_p (always at least one token)
+                probs[probs.cumsum(dim=-1) - probs >= self.top_p] = 0.0
+            next_tokens = cand_idx.gather(-1, torch.multinomial(probs, 1)).squeeze(-1).tolist()
+        for i, seq in enumerate(seqs):
+            if not seq.tokens and self.forced_bos_token_id is not None:
+                next_tokens[i] = self.forced_bos_token_id
+            elif len(seq.tokens) == seq.max_new_tokens - 1 and self.forced_eos_token_id is not None:
+                next_tokens[i] = self.forced_eos_token_id
+        return next_tokens
+
+    def _retire(self, seqs, next_tokens):
+        """Append each sequence's next token and drop the finished ones from the running batch."""
+        finished = []
+        for seq, token in zip(seqs, next_tokens):
+            seq.tokens.append(token)
+            if token == self.eos_token_id or len(seq.tokens) >= seq.max_new_tokens:
+                finished.append(seq)
+        if not finished:
+            return
+        self._unpack_batch()
+        done = set(map(id, finished))
+        self._running = [seq for seq in self._running if id(seq) not in done]
+        for seq in finished:
+            seq.cache = None
+            request = seq.request
+            request.outputs[seq.index] = seq.tokens
+            request.remaining -= 1
+            if request.remaining == 0 and not request.future.done():
+                request.future.set_result(request.outputs)
+
+    def _fail(self, seq, error):
+        seq.cache = None
+        if not seq.request.future.done():
+            seq.request.future.set_exception(error)
+
+    # === Per-sequence caches <-> padded batch ===
+    @staticmethod
+    def _layers(cache):
+        self_layers = cache.self_attention_cache.layers
+        cross_layers = cache.cross_attention_cache.layers
+        return [(s.keys, s.values, c.keys, c.values) for s, c in zip(self_layers, cross_layers)]
+
+    def _pad_encoder(self, seqs):
+        src_len = max(seq.encoder_hidden.shape[0] for seq in seqs)
+        first = seqs[0].encoder_hidden
+        enc = first.new_zeros(len(seqs), src_len, first.shape[-1])
+        enc_mask = torch.zeros(len(seqs), src_len, dtype=torch.long, device=first.device)
+        for b, seq in enumerate(seqs):
+            n = seq.encoder_hidden.shape[0]
+            enc[b, :n] = seq.encoder_hidden
+            enc_mask[b, :n] = 1
+        return enc, enc_mask
+
+    def _pack_batch(self):
+        """Stack the running sequences' caches: decoder history left-padded, encoder side right-padded."""
+        seqs = self._running
+        enc, enc_mask = self._pad_encoder(seqs)
+        hist_len = max(len(seq.tokens) for seq in seqs)
+        decoder_mask = torch.zeros(len(seqs), hist_len, dtype=torch.long, device=enc.device)
+        for b, seq in enumerate(seqs):
+            decoder_mask[b, hist_len - len(seq.tokens):] = 1
+        self_data, cross_data = [], []
+        for layer in range(len(seqs[0].cache)):
+            parts = [seq.cache[layer] for seq in seqs]
+            self_data.append(tuple(
+                torch.cat([self._pad(p[i], hist_len, left=True) for p in parts]) for i in (0, 1)))
+            cross_data.append(tuple(
+                torch.cat([self._pad(p[i], enc.shape[1], left=False) for p in parts]) for i in (2, 3)))
+        cache = EncoderDecoderCache(DynamicCache(self_data), DynamicCache(cross_data))
+        self._batch = {"enc": enc, "enc_mask": enc_mask, "decoder_mask": decoder_mask, "cache": cache}
+        for seq in seqs:
+            seq.cache = None
+
+    def _unpack_batch(self):
+        """Copy each running sequence's slice of the batch cache back to it, without padding."""
+        if self._batch is None:
+            return
+        hist_len = self._batch["decoder_mask"].shape[1]
+        layers = self._layers(self._batch["cache"])
+        for b, seq in enumerate(self._running):
+            # the batch already holds the keys/values of the token just appended to seq.tokens
+            n, pad = len(seq.tokens), hist_len - len(seq.tokens)
+            src_len = seq.encoder_hidden.shape[0]
+            seq.cache = [(sk[b:b + 1, :, pad:pad + n], sv[b:b + 1, :, pad:pad + n],
+                          ck[b:b + 1, :, :src_len], cv[b:b + 1, :, :src_len]) for sk, sv, ck, cv in layers]
+        self._batch = None
+
+    @staticmethod
+    def _pad(t, length, left):
+        missing = length - t.shape[2]
+        if missing == 0:
+            return t
+        pad = t.new_zeros(t.shape[0], t.shape[1], missing, t.shape[3])
+        return torch.cat([pad, t] if left else [t, pad], dim=2)
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Near-duplicate reuse of detox rewrites. Inputs are embedded (mean-pooled encoder
+# states), looked up by cosine similarity in a bounded in-memory index, and on a
+# hit the stored rewrites are returned verbatim. They are never edited to fit the
+# new input: words carried over from it could put back the insult the rewrite removed.
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_CAPACITY = 10000
+
+
+def mean_pool(last_hidden_state, attention_mask, skip=0):
+    """Mean of the token states under the attention mask, one vector per row.
+
+    skip drops that many leading tokens (the shared prompt prefix), so similarity
+    comes from the input text only; rows are assumed right-padded.
+    """
+    mask = attention_mask.clone()
+    mask[:, :skip] = 0
+    mask = mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    return (summed / mask.sum(dim=1).clamp(min=1)).cpu().float().numpy()
+
+
+def checkpoint_fingerprint(model_dir):
+    """Hash of the checkpoint files; embeddings from another checkpoint are not comparable."""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and name.endswith((".safetensors", ".bin", ".json", ".model", ".txt")):
+            h.update(name.encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest()[:16]
+
+
+class SemanticCache:
+    """LRU-bounded cosine-similarity index from input embeddings to stored rewrites.
+
+    fingerprint identifies the checkpoint that produced the embeddings (see
+    checkpoint_fingerprint); a saved index with a different one is discarded on load.
+
+    A hit returns the stored rewrites unchanged, whatever words the new input swapped:
+
+    >>> cache = SemanticCache(dim=2, capacity=4)
+    >>> cache.add("you are a stupid person", [1.0, 0.0], ["you are a person I disagree with"])
+    >>> cache.lookup([1.0, 0.01])[0]
+    ['you are a person I disagree with']
+    """
+
+    def __init__(self, dim, capacity=DEFAULT_CAPACITY, threshold=DEFAULT_THRESHOLD, path=None, fingerprint=None):
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.path = path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._entries = OrderedDict()   # slot -> {"text", "rewrites"}, oldest first
+        self._free = list(range(capacity - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self.inserts_since_save = 0   # len() stops growing at capacity, so count inserts instead
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, vector, min_rewrites=1):
+        """Return (stored rewrites, similarity) for the nearest entry above threshold, else None."""
+        start = time.perf_counter()
+        query = self._normalize(vector)
+        with self._lock:
+            result = None
+            if self._entries:
+                sims = self._vectors @ query
+                sims[~self._valid] = -1.0
+                slot = int(np.argmax(sims))
+                entry = self._entries.get(slot)
+                if sims[slot] >= self.threshold and len(entry["rewrites"]) >= min_rewrites:
+                    self._entries.move_to_end(slot)
+                    result = (list(entry["rewrites"]), float(sims[slot]))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.lookup_seconds += time.perf_counter() - start
+        return result
+
+    def add(self, text, vector, rewrites):
+        with self._lock:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot, _ = self._entries.popitem(last=False)   # evict least recently used
+            self._vectors[slot] = self._normalize(vector)
+            self._valid[slot] = True
+            self._entries[slot] = {"text": text, "rewrites": list(rewrites)}
+            self.inserts_since_save += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_lookup_ms": 1000.0 * self.lookup_seconds / lookups if lookups else 0.0,
+            }
+
+    # === Persistence ===
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            slots = list(self._entries)   # oldest first, so LRU order survives a reload
+            vectors = self._vectors[slots] if slots else np.zeros((0, self.dim), dtype=np.float32)
+            meta = [self._entries[s] for s in slots]
+            self.inserts_since_save = 0
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, vectors=vectors, meta=np.array(json.dumps(meta)), fingerprint=np.array(self.fingerprint or ""))
+        os.replace(tmp, path)
+
+    def load(self, path):
+        data = np.load(path)
+        vectors, meta = data["vectors"], json.loads(str(data["meta"]))
+        fingerprint = str(data["fingerprint"]) if "fingerprint" in data.files else ""
+        if fingerprint != (self.fingerprint or ""):
+            print(f"Ignoring semantic cache {path}: built for checkpoint {fingerprint or 'unknown'}, "
+                  f"not {self.fingerprint or 'unknown'}")
+            return
+        if vectors.shape[1] != self.dim:
+            print(f"Ignoring semantic cache {path}: dimension {vectors.shape[1]} != {self.dim}")
+            return
+        # keep only the most recent entries if the capacity shrank
+        for vector, entry in list(zip(vectors, meta))[-self.capacity:]:
+            self.add(entry["text"], vector, entry["rewrites"])
+        self.inserts_since_save = 0
+        print(f"Loaded {len(self)} semantic cache entries from {path}")